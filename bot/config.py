@@ -5,11 +5,16 @@ load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 ADMIN_TELEGRAM_ID = int(os.getenv("ADMIN_TELEGRAM_ID", "0"))
+# Optional private channel the bot posts each drip to once, then copies to users
+DRIP_STORAGE_CHAT_ID = int(os.getenv("DRIP_STORAGE_CHAT_ID", "0"))
 
 DATABASE_URL = os.getenv("DATABASE_URL", "")
 # Render uses postgres:// but SQLAlchemy needs postgresql://
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+# Connections per process: pool + overflow must fit the Postgres plan's limit
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE") or 5)
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW") or 10)
 
 CLOUDINARY_CLOUD_NAME = os.getenv("CLOUDINARY_CLOUD_NAME")
 CLOUDINARY_API_KEY = os.getenv("CLOUDINARY_API_KEY")
@@ -30,6 +35,8 @@ OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
 # Web dashboard auth
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "changeme")
+# Re-read edited dashboard templates without a restart (local development)
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "").lower() in ("1", "true", "yes")
 
 BASE_URL = os.getenv("BASE_URL", "http://localhost:10000")
 PORT = int(os.getenv("PORT", "10000"))
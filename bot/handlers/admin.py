@@ -6,6 +6,7 @@ from telegram.ext import (
 )
 from bot.config import ADMIN_TELEGRAM_ID
 from bot.models.database import SessionLocal
+from bot.services import user_cache
 from bot.models.schemas import (
     Category, Image, Order, User, OrderStatus, ContentType,
     FlashSale, DripSchedule, CustomRequest, RequestStatus, Subscription, SubscriptionStatus
@@ -167,6 +168,8 @@ async def add_category_emoji(update: Update, context: ContextTypes.DEFAULT_TYPE)
         db.add(cat)
         db.commit()
         db.refresh(cat)
+        from bot.web.dashboard import invalidate_category_lookup
+        invalidate_category_lookup()
         await update.message.reply_text(
             f"✅ Category **{emoji} {name}** created! (ID: {cat.id})\n\n"
             f"Now upload images to it with /admin → Upload Image",
@@ -806,8 +809,8 @@ async def admin_set_request_price(update: Update, context: ContextTypes.DEFAULT_
         db.commit()
 
         # Notify user
-        user = db.query(User).get(req.user_id)
-        if user:
+        telegram_id = user_cache.telegram_id_for(db, req.user_id)
+        if telegram_id:
             from telegram import InlineKeyboardButton, InlineKeyboardMarkup
             kb = [[InlineKeyboardButton(
                 f"💳 Pay ${price:.0f}",
@@ -815,7 +818,7 @@ async def admin_set_request_price(update: Update, context: ContextTypes.DEFAULT_
             )]]
             try:
                 await context.bot.send_message(
-                    chat_id=user.telegram_id,
+                    chat_id=telegram_id,
                     text=(
                         f"✨ **Custom Request #{req.id} Accepted!**\n\n"
                         f"💰 Price: **${price:.0f}**\n\n"
@@ -854,11 +857,11 @@ async def admin_reject_request(update: Update, context: ContextTypes.DEFAULT_TYP
         req.status = RequestStatus.REJECTED.value
         db.commit()
 
-        user = db.query(User).get(req.user_id)
-        if user:
+        telegram_id = user_cache.telegram_id_for(db, req.user_id)
+        if telegram_id:
             try:
                 await context.bot.send_message(
-                    chat_id=user.telegram_id,
+                    chat_id=telegram_id,
                     text=(
                         f"❌ **Custom Request #{req.id}** was not accepted.\n\n"
                         f"Sorry about that! Feel free to submit a new one with /request"
@@ -938,11 +941,11 @@ async def admin_deliver_request_image(update: Update, context: ContextTypes.DEFA
         db.commit()
 
         # Deliver to user
-        user = db.query(User).get(req.user_id)
-        if user:
+        telegram_id = user_cache.telegram_id_for(db, req.user_id)
+        if telegram_id:
             try:
                 await context.bot.send_photo(
-                    chat_id=user.telegram_id,
+                    chat_id=telegram_id,
                     photo=result["full_url"],
                     caption=(
                         f"✨ **Custom Request #{req_id} — Delivered!**\n\n"
@@ -1146,16 +1149,18 @@ async def broadcast_send(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message_text = update.message.text
     db = SessionLocal()
     try:
-        users = db.query(User).filter(User.is_banned == False).all()
+        telegram_ids = [
+            tid for (tid,) in db.query(User.telegram_id).filter(User.is_banned == False)
+        ]
         success = 0
         failed = 0
 
-        await update.message.reply_text(f"📤 Sending to {len(users)} users...")
+        await update.message.reply_text(f"📤 Sending to {len(telegram_ids)} users...")
 
-        for user in users:
+        for telegram_id in telegram_ids:
             try:
                 await context.bot.send_message(
-                    chat_id=user.telegram_id,
+                    chat_id=telegram_id,
                     text=message_text,
                     parse_mode="Markdown"
                 )
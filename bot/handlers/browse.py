@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session
 from bot.models.database import SessionLocal
 from bot.models.schemas import Category, Image, User, Order, OrderStatus, ContentType
 from bot.handlers.flash_sales import get_flash_price
+from bot.services.delivery import full_photo
 
 logger = logging.getLogger(__name__)
 
@@ -250,7 +251,7 @@ async def image_detail_callback(update: Update, context: ContextTypes.DEFAULT_TY
         if already_owned:
             # Send the full image directly
             text = f"✅ **{image.title}**\n\nYou already own this! Here it is:"
-            photo_source = bytes(image.file_data) if image.file_data else image.cloudinary_url
+            photo_source = full_photo(image)
             await query.message.reply_photo(
                 photo=photo_source,
                 caption=text,
@@ -4,14 +4,17 @@ Catches all text messages that aren't commands or handled by other handlers.
 When AI detects purchase intent, creates a PayPal payment link and sends it.
 """
 
+import time
 import logging
 import datetime
 import random
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes, MessageHandler, CommandHandler, filters
 
 from bot.services.openai_chat import (
     chat, clear_history, ContentRequest, get_post_offer_reply, get_last_tool_call_id,
+    conversation_turn, withdraw_offer,
 )
 from bot.config import OPENAI_API_KEY
 from bot.models.database import SessionLocal
@@ -20,6 +23,10 @@ from bot.services import paypal
 
 logger = logging.getLogger(__name__)
 
+# Minimum gap between edits of a streaming reply — Telegram allows about
+# one message (edits included) per second in a chat
+STREAM_EDIT_INTERVAL = 1.0
+
 
 async def _find_image_for_user(telegram_id: int):
     """Pick a random private image the user hasn't purchased yet."""
@@ -106,6 +113,61 @@ async def _create_payment_for_chat(user: User, image: Image, db) -> dict:
     }
 
 
+NO_CONTENT_REPLY = "I'm working on something new just for you… not quite ready yet, but soon 💋"
+NO_USER_REPLY = "Send /start first so I know who you are 💋"
+
+
+async def _handle_offer(update: Update, telegram_id: int, user_name: str, result: ContentRequest):
+    """Find an image, create its payment and send the offer.
+    Runs inside the chat turn's conversation_turn(); if no offer is made,
+    the dangling offer_content call is withdrawn from the history."""
+    db = None
+    try:
+        image, user, db = await _find_image_for_user(telegram_id)
+
+        if not user:
+            withdraw_offer(telegram_id, NO_USER_REPLY)
+            await update.message.reply_text(NO_USER_REPLY)
+            return
+
+        if not image:
+            logger.info(f"No images available for user {telegram_id}")
+            # No content to sell — clear the dangling tool call from history
+            withdraw_offer(telegram_id, NO_CONTENT_REPLY)
+            await update.message.reply_text(NO_CONTENT_REPLY)
+            return
+
+        # Create payment
+        payment = await _create_payment_for_chat(user, image, db)
+
+        # Get AI's natural response about the offer
+        tool_call_id = get_last_tool_call_id(telegram_id)
+        ai_reply = await get_post_offer_reply(
+            telegram_id, tool_call_id, image.title, int(payment["price"]), user_name,
+            vibe=result.vibe,
+        )
+    except Exception:
+        # Never leave a tool call without its result in the history
+        withdraw_offer(telegram_id, "I got a little distracted… send that again? 💭")
+        raise
+    finally:
+        if db:
+            db.close()
+
+    # Send AI message + payment button
+    keyboard = [
+        [InlineKeyboardButton(
+            f"💳 Unlock for ${payment['price']:.0f}",
+            url=payment["approve_url"]
+        )],
+    ]
+
+    await update.message.reply_text(
+        ai_reply,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
+
+
 async def handle_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle any text message as an AI chat message."""
     if not update.message or not update.message.text:
@@ -120,69 +182,46 @@ async def handle_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     tg_user = update.effective_user
     user_name = tg_user.first_name or tg_user.username or ""
 
+    # The reply is shown as it streams in: sent on the first fragment,
+    # then edited in place at most every STREAM_EDIT_INTERVAL
+    draft = None
+    last_edit = 0.0
+
+    async def show_partial(text: str):
+        nonlocal draft, last_edit
+        now = time.monotonic()
+        if draft is not None and now - last_edit < STREAM_EDIT_INTERVAL:
+            return
+        last_edit = now
+        try:
+            if draft is None:
+                draft = await update.message.reply_text(text)
+            else:
+                draft = await draft.edit_text(text)
+        except TelegramError as e:
+            logger.debug(f"Streaming update failed for user {tg_user.id}: {e}")
+
     try:
         # Show typing indicator
         await update.message.chat.send_action("typing")
 
-        result = await chat(
-            user_id=tg_user.id,
-            user_message=update.message.text,
-            user_name=user_name,
-        )
+        # The whole turn, offer included, runs under the user's history lock
+        async with conversation_turn(tg_user.id):
+            result = await chat(
+                user_id=tg_user.id,
+                user_message=update.message.text,
+                user_name=user_name,
+                on_partial=show_partial,
+            )
+            if isinstance(result, ContentRequest):
+                await _handle_offer(update, tg_user.id, user_name, result)
+                return
 
         # Normal text reply
-        if isinstance(result, str):
+        if draft is None:
             await update.message.reply_text(result)
-            return
-
-        # AI triggered purchase intent
-        if isinstance(result, ContentRequest):
-            db = None
-            try:
-                image, user, db = await _find_image_for_user(tg_user.id)
-
-                if not user:
-                    await update.message.reply_text("Send /start first so I know who you are 💋")
-                    return
-
-                if not image:
-                    logger.info(f"No images available for user {tg_user.id}")
-                    # No content to sell — clear the dangling tool call from history
-                    from bot.services.openai_chat import _histories
-                    hist = _histories.get(tg_user.id, [])
-                    if hist and hist[-1].get("tool_calls"):
-                        hist.pop()
-                    hist.append({"role": "assistant", "content": "I'm working on something new just for you… not quite ready yet, but soon 💋"})
-                    await update.message.reply_text(
-                        "I'm working on something new just for you… not quite ready yet, but soon 💋"
-                    )
-                    return
-
-                # Create payment
-                payment = await _create_payment_for_chat(user, image, db)
-
-                # Get AI's natural response about the offer
-                tool_call_id = get_last_tool_call_id(tg_user.id)
-                ai_reply = await get_post_offer_reply(
-                    tg_user.id, tool_call_id, image.title, int(payment["price"]), user_name
-                )
-
-                # Send AI message + payment button
-                keyboard = [
-                    [InlineKeyboardButton(
-                        f"💳 Unlock for ${payment['price']:.0f}",
-                        url=payment["approve_url"]
-                    )],
-                ]
-
-                await update.message.reply_text(
-                    ai_reply,
-                    reply_markup=InlineKeyboardMarkup(keyboard),
-                )
-
-            finally:
-                if db:
-                    db.close()
+        elif draft.text != result:
+            await draft.edit_text(result)
 
     except Exception as e:
         logger.error(f"Chat handler error for user {tg_user.id}: {e}", exc_info=True)
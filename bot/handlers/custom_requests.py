@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -111,28 +112,27 @@ async def confirm_request_callback(update: Update, context: ContextTypes.DEFAULT
         db.commit()
         db.refresh(req)
 
-        await query.edit_message_text(
-            f"✅ **Request #{req.id} Submitted!**\n\n"
-            f"I'll review it and get back to you with a price.\n"
-            f"You'll receive a notification when it's ready.\n\n"
-            f"Check status anytime with /myrequests",
-            parse_mode="Markdown"
-        )
-
-        # Notify admin
+        # Confirm to the user and notify admin concurrently
         from bot.config import ADMIN_TELEGRAM_ID
-        try:
-            admin_keyboard = [
-                [InlineKeyboardButton(
-                    "💰 Set Price & Accept",
-                    callback_data=f"admin_req_accept_{req.id}"
-                )],
-                [InlineKeyboardButton(
-                    "❌ Reject",
-                    callback_data=f"admin_req_reject_{req.id}"
-                )],
-            ]
-            await context.bot.send_message(
+        admin_keyboard = [
+            [InlineKeyboardButton(
+                "💰 Set Price & Accept",
+                callback_data=f"admin_req_accept_{req.id}"
+            )],
+            [InlineKeyboardButton(
+                "❌ Reject",
+                callback_data=f"admin_req_reject_{req.id}"
+            )],
+        ]
+        user_result, admin_result = await asyncio.gather(
+            query.edit_message_text(
+                f"✅ **Request #{req.id} Submitted!**\n\n"
+                f"I'll review it and get back to you with a price.\n"
+                f"You'll receive a notification when it's ready.\n\n"
+                f"Check status anytime with /myrequests",
+                parse_mode="Markdown"
+            ),
+            context.bot.send_message(
                 chat_id=ADMIN_TELEGRAM_ID,
                 text=(
                     f"📬 **New Custom Request #{req.id}**\n\n"
@@ -143,9 +143,13 @@ async def confirm_request_callback(update: Update, context: ContextTypes.DEFAULT
                 ),
                 reply_markup=InlineKeyboardMarkup(admin_keyboard),
                 parse_mode="Markdown"
-            )
-        except Exception as e:
-            logger.warning(f"Failed to notify admin of new request: {e}")
+            ),
+            return_exceptions=True,
+        )
+        if isinstance(admin_result, Exception):
+            logger.warning(f"Failed to notify admin of new request: {admin_result}")
+        if isinstance(user_result, Exception):
+            raise user_result
 
     finally:
         db.close()
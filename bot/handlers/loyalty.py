@@ -1,9 +1,11 @@
 import logging
-import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from sqlalchemy import func
 from bot.models.database import SessionLocal
 from bot.models.schemas import User, Image, Order, OrderStatus, LoyaltyRedemption
+from bot.services import user_cache
+from bot.services.delivery import full_photo
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +49,51 @@ REWARDS = {
 }
 
 
+def _render_loyalty(user: User, total_redeemed: int) -> tuple:
+    """Build the points balance + rewards catalog as (text, reply_markup)."""
+    text = (
+        f"⭐ **Loyalty Points**\n\n"
+        f"Your balance: **{user.loyalty_points:,} pts**\n"
+        f"Rewards redeemed: **{total_redeemed}**\n\n"
+        f"💡 Earn points:\n"
+        f"  • 10 pts per $1 spent on images\n"
+        f"  • 15 pts per $1 spent on subscriptions\n"
+        f"  • 50 pts for each referral\n\n"
+        f"🎁 **Rewards Catalog:**\n\n"
+    )
+
+    keyboard = []
+    for reward_key, reward in REWARDS.items():
+        can_afford = user.loyalty_points >= reward["points"]
+        status = "✅" if can_afford else "🔒"
+        text += (
+            f"{reward['emoji']} **{reward['name']}**\n"
+            f"  {status} {reward['points']:,} pts\n\n"
+        )
+        if can_afford:
+            keyboard.append([
+                InlineKeyboardButton(
+                    f"{reward['emoji']} Redeem: {reward['name']}",
+                    callback_data=f"redeem_{reward_key}"
+                )
+            ])
+
+    if not keyboard:
+        text += "_Keep shopping to earn more points!_ 🛍"
+
+    keyboard.append([InlineKeyboardButton("🔙 Menu", callback_data="back_to_menu")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+def _count_redeemed(db, user_id: int) -> int:
+    """Count how many rewards the user has redeemed so far."""
+    return (
+        db.query(LoyaltyRedemption)
+        .filter(LoyaltyRedemption.user_id == user_id)
+        .count()
+    )
+
+
 async def loyalty_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show loyalty points balance and rewards catalog."""
     tg_user = update.effective_user
@@ -57,47 +104,9 @@ async def loyalty_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Please /start the bot first.")
             return
 
-        # Count total redeemed
-        total_redeemed = (
-            db.query(LoyaltyRedemption)
-            .filter(LoyaltyRedemption.user_id == user.id)
-            .count()
-        )
-
-        text = (
-            f"⭐ **Loyalty Points**\n\n"
-            f"Your balance: **{user.loyalty_points:,} pts**\n"
-            f"Rewards redeemed: **{total_redeemed}**\n\n"
-            f"💡 Earn points:\n"
-            f"  • 10 pts per $1 spent on images\n"
-            f"  • 15 pts per $1 spent on subscriptions\n"
-            f"  • 50 pts for each referral\n\n"
-            f"🎁 **Rewards Catalog:**\n\n"
-        )
-
-        keyboard = []
-        for reward_key, reward in REWARDS.items():
-            can_afford = user.loyalty_points >= reward["points"]
-            status = "✅" if can_afford else "🔒"
-            text += (
-                f"{reward['emoji']} **{reward['name']}**\n"
-                f"  {status} {reward['points']:,} pts\n\n"
-            )
-            if can_afford:
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"{reward['emoji']} Redeem: {reward['name']}",
-                        callback_data=f"redeem_{reward_key}"
-                    )
-                ])
-
-        if not keyboard:
-            text += "_Keep shopping to earn more points!_ 🛍"
-
-        keyboard.append([InlineKeyboardButton("🔙 Menu", callback_data="back_to_menu")])
-
+        text, reply_markup = _render_loyalty(user, _count_redeemed(db, user.id))
         await update.message.reply_text(
-            text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown"
+            text, reply_markup=reply_markup, parse_mode="Markdown"
         )
     finally:
         db.close()
@@ -115,32 +124,9 @@ async def loyalty_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not user:
             return
 
-        text = (
-            f"⭐ **Loyalty Points**\n\n"
-            f"Balance: **{user.loyalty_points:,} pts**\n\n"
-            f"🎁 **Available Rewards:**\n\n"
-        )
-
-        keyboard = []
-        for reward_key, reward in REWARDS.items():
-            can_afford = user.loyalty_points >= reward["points"]
-            if can_afford:
-                text += f"{reward['emoji']} {reward['name']} — {reward['points']:,} pts\n"
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"{reward['emoji']} {reward['name']} ({reward['points']:,} pts)",
-                        callback_data=f"redeem_{reward_key}"
-                    )
-                ])
-
-        if not keyboard:
-            text += f"_You need more points. Keep shopping!_ 🛍\n\n"
-            text += "Cheapest reward: 300 pts (10% discount)"
-
-        keyboard.append([InlineKeyboardButton("🔙 Menu", callback_data="back_to_menu")])
-
+        text, reply_markup = _render_loyalty(user, _count_redeemed(db, user.id))
         await query.edit_message_text(
-            text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown"
+            text, reply_markup=reply_markup, parse_mode="Markdown"
         )
     finally:
         db.close()
@@ -186,6 +172,7 @@ async def redeem_reward_callback(update: Update, context: ContextTypes.DEFAULT_T
             )
             db.add(redemption)
             db.commit()
+            user_cache.invalidate(user.telegram_id)
 
             await query.answer()
             await query.message.reply_text(
@@ -256,6 +243,7 @@ async def redeem_reward_callback(update: Update, context: ContextTypes.DEFAULT_T
                 )
                 user.free_unlocks += 1
                 db.commit()
+                user_cache.invalidate(user.telegram_id)
                 return
 
             keyboard = [
@@ -318,14 +306,14 @@ async def loyalty_pick_image_callback(update: Update, context: ContextTypes.DEFA
             image_id=image.id,
             amount=0.0,
             status=OrderStatus.COMPLETED.value,
-            completed_at=datetime.datetime.utcnow(),
+            completed_at=func.timezone("utc", func.now()),  # stamped by the DB, naive UTC like complete_order()
         )
         db.add(order)
         image.total_sales += 1
         db.commit()
 
         # Send the image
-        photo_source = bytes(image.file_data) if image.file_data else image.cloudinary_url
+        photo_source = full_photo(image)
         await query.message.reply_photo(
             photo=photo_source,
             caption=(
@@ -1,11 +1,12 @@
 import logging
-import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from sqlalchemy import func
 from bot.models.database import SessionLocal
 from bot.models.schemas import User, Image, Order, OrderStatus
-from bot.services import paypal
+from bot.services import paypal, user_cache
 from bot.handlers.flash_sales import get_flash_price
+from bot.services.delivery import full_photo, compute_tier
 
 logger = logging.getLogger(__name__)
 
@@ -22,14 +23,25 @@ def _get_user_discount(user: User) -> float:
     return tier_discounts.get(user.vip_tier, 1.0)
 
 
+def _owns_image(db, user_id: int, image_id: int) -> bool:
+    """True if the user has a completed order for the image.
+    SELECT EXISTS — answered from ix_orders_user_image_status, no row loaded."""
+    return db.query(
+        db.query(Order.id)
+        .filter(
+            Order.user_id == user_id,
+            Order.image_id == image_id,
+            Order.status == OrderStatus.COMPLETED.value,
+        )
+        .exists()
+    ).scalar()
+
+
 def _update_vip_tier(user: User, db):
     """Auto-upgrade VIP tier based on total spending."""
-    if user.total_spent >= 150:
-        user.vip_tier = "gold"
-    elif user.total_spent >= 75:
-        user.vip_tier = "silver"
-    elif user.total_spent >= 25:
-        user.vip_tier = "bronze"
+    earned = compute_tier(user.total_spent)
+    if earned != "free":
+        user.vip_tier = earned
     db.commit()
 
 
@@ -55,17 +67,8 @@ async def buy_image_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return
 
         # Check if already owned
-        existing = (
-            db.query(Order)
-            .filter(
-                Order.user_id == user.id,
-                Order.image_id == image.id,
-                Order.status == OrderStatus.COMPLETED.value
-            )
-            .first()
-        )
-        if existing:
-            photo_source = bytes(image.file_data) if image.file_data else image.cloudinary_url
+        if _owns_image(db, user.id, image.id):
+            photo_source = full_photo(image)
             await query.message.reply_photo(
                 photo=photo_source,
                 caption=f"✅ You already own **{image.title}**! Here it is:",
@@ -185,12 +188,13 @@ async def free_unlock_callback(update: Update, context: ContextTypes.DEFAULT_TYP
             image_id=image.id,
             amount=0.0,
             status=OrderStatus.COMPLETED.value,
-            completed_at=datetime.datetime.utcnow(),
+            completed_at=func.timezone("utc", func.now()),  # stamped by the DB, naive UTC like complete_order()
         )
         db.add(order)
         user.free_unlocks -= 1
         image.total_sales += 1
         db.commit()
+        user_cache.invalidate(user.telegram_id)
 
         # Send the full image
         if image.file_data:
@@ -312,21 +316,11 @@ async def resend_image_callback(update: Update, context: ContextTypes.DEFAULT_TY
             return
 
         # Verify ownership
-        owned = (
-            db.query(Order)
-            .filter(
-                Order.user_id == user.id,
-                Order.image_id == image.id,
-                Order.status == OrderStatus.COMPLETED.value
-            )
-            .first()
-        )
-
-        if not owned:
+        if not _owns_image(db, user.id, image.id):
             await query.message.reply_text("❌ You don't own this image.")
             return
 
-        photo_source = bytes(image.file_data) if image.file_data else image.cloudinary_url
+        photo_source = full_photo(image)
         await query.message.reply_photo(
             photo=photo_source,
             caption=f"📸 **{image.title}**",
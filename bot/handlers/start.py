@@ -1,19 +1,76 @@
 import logging
-import uuid
+import secrets
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
 from sqlalchemy.orm import Session
 from bot.models.database import SessionLocal
 from bot.models.schemas import User
+from bot.services import user_cache
+from bot.services.user_cache import CachedUser
 
 logger = logging.getLogger(__name__)
 
+HELP_TEXT = (
+    "💡 **How it works:**\n\n"
+    "1️⃣ Browse my collection by category\n"
+    "2️⃣ See a preview of what you like\n"
+    "3️⃣ Tap 'Unlock' to get the payment link\n"
+    "4️⃣ Pay securely via PayPal\n"
+    "5️⃣ Image is sent to you instantly!\n\n"
+    "**Commands:**\n"
+    "/start — Main menu\n"
+    "/browse — Browse collection\n"
+    "/popular — Most popular content\n"
+    "/deals — Flash sales & deals\n"
+    "/subscribe — VIP subscriptions\n"
+    "/loyalty — Points & rewards\n"
+    "/request — Custom content request\n"
+    "/mypurchases — Your unlocked content\n"
+    "/myrequests — Your custom requests\n"
+    "/referral — Share & earn free unlocks\n"
+    "/newchat — Start a fresh conversation with me\n"
+    "/help — This message\n"
+    "\n💬 **Just type anything** to chat with me!"
+)
+
+VIP_TEXT = (
+    "💎 **VIP Tiers**\n\n"
+    "🥉 **Bronze** — 5% off all purchases\n"
+    "  Spend $25+ total to unlock\n\n"
+    "🥈 **Silver** — 10% off + early access to new drops\n"
+    "  Spend $75+ total to unlock\n\n"
+    "🥇 **Gold** — 20% off + exclusive content + priority requests\n"
+    "  Spend $150+ total to unlock\n\n"
+    "Your tier upgrades automatically as you shop! 🛍"
+)
+
+# Main menu, built once — only the "Claim Free" row varies per user
+_FREE_ROW = [InlineKeyboardButton("🎁 Claim Free Image", callback_data="claim_free")]
+_BASE_ROWS = [
+    [InlineKeyboardButton("🖼 Browse Collection", callback_data="browse_categories")],
+    [InlineKeyboardButton("🔥 What's Hot", callback_data="browse_popular")],
+    [
+        InlineKeyboardButton("⚡ Deals", callback_data="view_deals"),
+        InlineKeyboardButton("⭐ Loyalty", callback_data="view_loyalty"),
+    ],
+    [InlineKeyboardButton("💎 VIP Subscribe", callback_data="vip_info")],
+    [InlineKeyboardButton("✨ Custom Request", callback_data="start_custom_request")],
+]
+_MENU_WITH_FREE = InlineKeyboardMarkup([_FREE_ROW] + _BASE_ROWS)
+_MENU_NO_FREE = InlineKeyboardMarkup(_BASE_ROWS)
+
+
+def _get_or_create_user(db: Session, telegram_id: int, username: str = None, first_name: str = None) -> CachedUser:
+    """Get existing user or create a new one.
+    Served from the user cache when the Telegram profile hasn't changed."""
+    cached = user_cache.get(telegram_id)
+    if cached and username in (None, cached.username) and first_name in (None, cached.first_name):
+        user_cache.touch(telegram_id)
+        return cached
 
-def _get_or_create_user(db: Session, telegram_id: int, username: str = None, first_name: str = None) -> User:
-    """Get existing user or create a new one."""
     user = db.query(User).filter(User.telegram_id == telegram_id).first()
     if not user:
-        referral_code = uuid.uuid4().hex[:8].upper()
+        referral_code = secrets.token_urlsafe(6).upper().replace("_", "A").replace("-", "B")
         user = User(
             telegram_id=telegram_id,
             username=username,
@@ -22,24 +79,32 @@ def _get_or_create_user(db: Session, telegram_id: int, username: str = None, fir
             free_unlocks=1,
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        db.flush()  # assigns user.id via INSERT ... RETURNING
     else:
-        import datetime
-        user.last_active = datetime.datetime.utcnow()
         if username:
             user.username = username
         if first_name:
             user.first_name = first_name
-        db.commit()
-    return user
+        user_cache.touch(telegram_id)
+
+    # Snapshot before commit — commit expires the row and would force a reload
+    cached = user_cache.put(user)
+    db.commit()
+    return cached
+
+
+def _get_free_unlocks(db: Session, telegram_id: int) -> int:
+    """Read just the free unlock count for menu rendering."""
+    cached = user_cache.get(telegram_id)
+    if cached:
+        return cached.free_unlocks
+    return db.query(User.free_unlocks).filter(User.telegram_id == telegram_id).scalar() or 0
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command — welcome funnel."""
     tg_user = update.effective_user
-    db = SessionLocal()
-    try:
+    with SessionLocal() as db:
         user = _get_or_create_user(
             db, tg_user.id, tg_user.username, tg_user.first_name
         )
@@ -59,55 +124,15 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         welcome_text += "What would you like to do?"
 
-        keyboard = []
-        if is_new:
-            keyboard.append([
-                InlineKeyboardButton("🎁 Claim Free Image", callback_data="claim_free")
-            ])
-        keyboard.extend([
-            [InlineKeyboardButton("🖼 Browse Collection", callback_data="browse_categories")],
-            [InlineKeyboardButton("🔥 What's Hot", callback_data="browse_popular")],
-            [
-                InlineKeyboardButton("⚡ Deals", callback_data="view_deals"),
-                InlineKeyboardButton("⭐ Loyalty", callback_data="view_loyalty"),
-            ],
-            [InlineKeyboardButton("💎 VIP Subscribe", callback_data="vip_info")],
-            [InlineKeyboardButton("✨ Custom Request", callback_data="start_custom_request")],
-        ])
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _MENU_WITH_FREE if is_new else _MENU_NO_FREE
         await update.message.reply_text(
             welcome_text, reply_markup=reply_markup, parse_mode="Markdown"
         )
-    finally:
-        db.close()
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command."""
-    help_text = (
-        "💡 **How it works:**\n\n"
-        "1️⃣ Browse my collection by category\n"
-        "2️⃣ See a preview of what you like\n"
-        "3️⃣ Tap 'Unlock' to get the payment link\n"
-        "4️⃣ Pay securely via PayPal\n"
-        "5️⃣ Image is sent to you instantly!\n\n"
-        "**Commands:**\n"
-        "/start — Main menu\n"
-        "/browse — Browse collection\n"
-        "/popular — Most popular content\n"
-        "/deals — Flash sales & deals\n"
-        "/subscribe — VIP subscriptions\n"
-        "/loyalty — Points & rewards\n"
-        "/request — Custom content request\n"
-        "/mypurchases — Your unlocked content\n"
-        "/myrequests — Your custom requests\n"
-        "/referral — Share & earn free unlocks\n"
-        "/newchat — Start a fresh conversation with me\n"
-        "/help — This message\n"
-        "\n💬 **Just type anything** to chat with me!"
-    )
-    await update.message.reply_text(help_text, parse_mode="Markdown")
+    await update.message.reply_text(HELP_TEXT, parse_mode="Markdown")
 
 
 async def vip_info_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -115,20 +140,9 @@ async def vip_info_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    vip_text = (
-        "💎 **VIP Tiers**\n\n"
-        "🥉 **Bronze** — 5% off all purchases\n"
-        "  Spend $25+ total to unlock\n\n"
-        "🥈 **Silver** — 10% off + early access to new drops\n"
-        "  Spend $75+ total to unlock\n\n"
-        "🥇 **Gold** — 20% off + exclusive content + priority requests\n"
-        "  Spend $150+ total to unlock\n\n"
-        "Your tier upgrades automatically as you shop! 🛍"
-    )
-
     keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]]
     await query.edit_message_text(
-        vip_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown"
+        VIP_TEXT, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown"
     )
 
 
@@ -138,34 +152,18 @@ async def back_to_menu_callback(update: Update, context: ContextTypes.DEFAULT_TY
     await query.answer()
 
     tg_user = update.effective_user
-    db = SessionLocal()
-    try:
-        user = _get_or_create_user(db, tg_user.id)
-        has_free = user.free_unlocks > 0
-    finally:
-        db.close()
+    with SessionLocal() as db:
+        has_free = _get_free_unlocks(db, tg_user.id) > 0
 
     text = f"Hey {tg_user.first_name or 'babe'} 💋\nWhat would you like to do?"
+    markup = _MENU_WITH_FREE if has_free else _MENU_NO_FREE
 
-    keyboard = []
-    if has_free:
-        keyboard.append([
-            InlineKeyboardButton("🎁 Claim Free Image", callback_data="claim_free")
-        ])
-    keyboard.extend([
-        [InlineKeyboardButton("🖼 Browse Collection", callback_data="browse_categories")],
-        [InlineKeyboardButton("🔥 What's Hot", callback_data="browse_popular")],
-        [
-            InlineKeyboardButton("⚡ Deals", callback_data="view_deals"),
-            InlineKeyboardButton("⭐ Loyalty", callback_data="view_loyalty"),
-        ],
-        [InlineKeyboardButton("💎 VIP Subscribe", callback_data="vip_info")],
-        [InlineKeyboardButton("✨ Custom Request", callback_data="start_custom_request")],
-    ])
+    # Already showing this exact menu (e.g. a double tap) — skip the Bot API call
+    msg = query.message
+    if msg and msg.text == text and msg.reply_markup == markup:
+        return
 
-    await query.edit_message_text(
-        text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown"
-    )
+    await query.edit_message_text(text, reply_markup=markup, parse_mode="Markdown")
 
 
 async def claim_free_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -174,12 +172,8 @@ async def claim_free_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.answer()
 
     tg_user = update.effective_user
-    db = SessionLocal()
-    try:
-        user = _get_or_create_user(db, tg_user.id)
-        free_count = user.free_unlocks or 0
-    finally:
-        db.close()
+    with SessionLocal() as db:
+        free_count = _get_free_unlocks(db, tg_user.id)
 
     if free_count <= 0:
         await query.edit_message_text(
@@ -221,12 +215,26 @@ async def start_custom_request_callback(update: Update, context: ContextTypes.DE
     )
 
 
+# Main-menu buttons share one CallbackQueryHandler and dispatch by callback_data
+_CB_TABLE = {
+    "vip_info": vip_info_callback,
+    "back_to_menu": back_to_menu_callback,
+    "start_custom_request": start_custom_request_callback,
+    "claim_free": claim_free_callback,
+}
+
+
+async def menu_callback_dispatch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Route a main-menu button press to its handler."""
+    await _CB_TABLE[update.callback_query.data](update, context)
+
+
 def get_start_handlers():
     return [
         CommandHandler("start", start_command),
         CommandHandler("help", help_command),
-        CallbackQueryHandler(vip_info_callback, pattern="^vip_info$"),
-        CallbackQueryHandler(back_to_menu_callback, pattern="^back_to_menu$"),
-        CallbackQueryHandler(start_custom_request_callback, pattern="^start_custom_request$"),
-        CallbackQueryHandler(claim_free_callback, pattern="^claim_free$"),
+        CallbackQueryHandler(
+            menu_callback_dispatch,
+            pattern=r"^(vip_info|back_to_menu|start_custom_request|claim_free)$",
+        ),
     ]
@@ -2,9 +2,11 @@ import logging
 import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from sqlalchemy import and_, or_, case, update
 from bot.models.database import SessionLocal
 from bot.models.schemas import User, Subscription, SubscriptionStatus, Image, Order, OrderStatus
-from bot.services import paypal
+from bot.services import paypal, user_cache
+from bot.services.clock import utcnow_1s
 
 logger = logging.getLogger(__name__)
 
@@ -39,32 +41,78 @@ SUB_TIERS = {
     },
 }
 
+# Activation notice sent after payment; fill with .format(expires=...)
+SUB_TIER_TEMPLATES = {
+    tier: (
+        f"✅ **VIP {info['name']} Activated!**\n\n"
+        f"{info['emoji']} Your perks are now active:\n" +
+        "\n".join(f"  • {p}" for p in info["perks"]) +
+        "\n\nExpires: {expires}\n"
+        "Enjoy your VIP status! 👑"
+    )
+    for tier, info in SUB_TIERS.items()
+}
+
+_TIER_RANK = {"bronze": 1, "silver": 2, "gold": 3}
+# Tiers a subscription to the key tier must not downgrade
+_HIGHER_TIERS = {
+    tier: [k for k, r in _TIER_RANK.items() if r > rank]
+    for tier, rank in _TIER_RANK.items()
+}
+
+# Static parts of the /subscribe screen, built once from SUB_TIERS
+_TIER_TEXT_BLOCK = "".join(
+    f"{t['emoji']} **{t['name']}** — ${t['price']:.0f}/mo\n"
+    + "".join(f"  • {p}\n" for p in t["perks"])
+    + "\n"
+    for t in SUB_TIERS.values()
+)
+_SUB_BUTTONS = {
+    k: InlineKeyboardButton(
+        f"{t['emoji']} Subscribe {t['name']} — ${t['price']:.0f}/mo", callback_data=f"sub_{k}"
+    )
+    for k, t in SUB_TIERS.items()
+}
+_UPGRADE_BUTTONS = {
+    k: InlineKeyboardButton(
+        f"{t['emoji']} Upgrade {t['name']} — ${t['price']:.0f}/mo", callback_data=f"sub_{k}"
+    )
+    for k, t in SUB_TIERS.items()
+}
+_CURRENT_BUTTONS = {
+    k: InlineKeyboardButton(f"✅ {t['emoji']} {t['name']} (Current)", callback_data="sub_current")
+    for k, t in SUB_TIERS.items()
+}
+
 
-def _get_active_sub(db, user_id: int) -> Subscription:
-    """Get user's active subscription if any."""
-    return (
-        db.query(Subscription)
-        .filter(
-            Subscription.user_id == user_id,
-            Subscription.status == SubscriptionStatus.ACTIVE.value,
-            Subscription.expires_at > datetime.datetime.utcnow(),
+def _get_user_and_active_sub(db, telegram_id: int) -> tuple:
+    """Load a user's id and their active subscription (or None) in one query.
+    Returns (None, None) if the user doesn't exist."""
+    row = (
+        db.query(User.id, Subscription)
+        .outerjoin(
+            Subscription,
+            and_(
+                Subscription.user_id == User.id,
+                Subscription.status == SubscriptionStatus.ACTIVE.value,
+                Subscription.expires_at > utcnow_1s(),
+            ),
         )
+        .filter(User.telegram_id == telegram_id)
         .first()
     )
+    return row if row else (None, None)
 
 
 async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show subscription tiers."""
     tg_user = update.effective_user
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.telegram_id == tg_user.id).first()
-        if not user:
+    with SessionLocal() as db:
+        user_id, active_sub = _get_user_and_active_sub(db, tg_user.id)
+        if not user_id:
             await update.message.reply_text("Please /start the bot first.")
             return
 
-        active_sub = _get_active_sub(db, user.id)
-
         text = "💎 **VIP Subscriptions**\n\n"
 
         if active_sub:
@@ -76,44 +124,24 @@ async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"─────────────────\n\n"
             )
 
-        for tier_key, tier in SUB_TIERS.items():
-            text += (
-                f"{tier['emoji']} **{tier['name']}** — ${tier['price']:.0f}/mo\n"
-            )
-            for perk in tier["perks"]:
-                text += f"  • {perk}\n"
-            text += "\n"
-
-        keyboard = []
-        for tier_key, tier in SUB_TIERS.items():
-            if active_sub and active_sub.tier == tier_key:
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"✅ {tier['emoji']} {tier['name']} (Current)",
-                        callback_data=f"sub_current"
-                    )
-                ])
-            else:
-                label = "Upgrade" if active_sub else "Subscribe"
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"{tier['emoji']} {label} {tier['name']} — ${tier['price']:.0f}/mo",
-                        callback_data=f"sub_{tier_key}"
-                    )
-                ])
+        text += _TIER_TEXT_BLOCK
 
         if active_sub:
+            keyboard = [
+                [_CURRENT_BUTTONS[k] if k == active_sub.tier else _UPGRADE_BUTTONS[k]]
+                for k in SUB_TIERS
+            ]
             keyboard.append([
                 InlineKeyboardButton("❌ Cancel Subscription", callback_data="sub_cancel")
             ])
+        else:
+            keyboard = [[_SUB_BUTTONS[k]] for k in SUB_TIERS]
 
         keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="back_to_menu")])
 
         await update.message.reply_text(
             text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown"
         )
-    finally:
-        db.close()
 
 
 async def subscribe_tier_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -129,57 +157,62 @@ async def subscribe_tier_callback(update: Update, context: ContextTypes.DEFAULT_
     tier = SUB_TIERS[tier_key]
     tg_user = update.effective_user
 
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.telegram_id == tg_user.id).first()
-        if not user:
-            await query.message.reply_text("Please /start the bot first.")
-            return
+    with SessionLocal() as db:
+        user_id = db.query(User.id).filter(User.telegram_id == tg_user.id).scalar()
+        if user_id:
+            # Create subscription record
+            sub = Subscription(
+                user_id=user_id,
+                tier=tier_key,
+                price_monthly=tier["price"],
+                status=SubscriptionStatus.PENDING.value,
+            )
+            db.add(sub)
+            db.flush()  # id comes back from INSERT ... RETURNING
+            sub_id = sub.id
+            db.commit()
 
-        # Create subscription record
-        sub = Subscription(
-            user_id=user.id,
-            tier=tier_key,
-            price_monthly=tier["price"],
-            status=SubscriptionStatus.PENDING.value,
-        )
-        db.add(sub)
-        db.commit()
-        db.refresh(sub)
+    if not user_id:
+        await query.message.reply_text("Please /start the bot first.")
+        return
 
-        # Create PayPal order
-        try:
-            pp_result = await paypal.create_order(
-                amount=tier["price"],
-                description=f"VIP {tier['name']} Subscription (1 month)",
-                custom_id=f"sub_{sub.id}",
+    # Create PayPal order — no DB connection held during the round-trip
+    try:
+        pp_result = await paypal.create_order(
+            amount=tier["price"],
+            description=f"VIP {tier['name']} Subscription (1 month)",
+            custom_id=f"sub_{sub_id}",
+        )
+    except Exception as e:
+        logger.error(f"PayPal subscription order failed: {e}")
+        with SessionLocal() as db:
+            db.query(Subscription).filter(Subscription.id == sub_id).update(
+                {"status": SubscriptionStatus.EXPIRED.value}
             )
-        except Exception as e:
-            logger.error(f"PayPal subscription order failed: {e}")
-            sub.status = SubscriptionStatus.EXPIRED.value
             db.commit()
-            await query.message.reply_text("❌ Payment system error. Try again later.")
-            return
+        await query.message.reply_text("❌ Payment system error. Try again later.")
+        return
 
-        sub.paypal_order_id = pp_result["order_id"]
+    with SessionLocal() as db:
+        db.query(Subscription).filter(Subscription.id == sub_id).update(
+            {"paypal_order_id": pp_result["order_id"]}
+        )
         db.commit()
 
-        keyboard = [
-            [InlineKeyboardButton("💳 Pay Now with PayPal", url=pp_result["approve_url"])],
-            [InlineKeyboardButton("🔙 Back", callback_data="back_to_menu")],
-        ]
+    keyboard = [
+        [InlineKeyboardButton("💳 Pay Now with PayPal", url=pp_result["approve_url"])],
+        [InlineKeyboardButton("🔙 Back", callback_data="back_to_menu")],
+    ]
 
-        await query.message.reply_text(
-            f"💎 **{tier['emoji']} {tier['name']} VIP Subscription**\n\n"
-            f"💰 ${tier['price']:.0f} for 1 month\n\n"
-            f"**Perks:**\n" +
-            "\n".join(f"  • {p}" for p in tier["perks"]) +
-            f"\n\nClick below to pay. Your VIP access activates **instantly**! ⚡",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode="Markdown"
-        )
-    finally:
-        db.close()
+    await query.message.reply_text(
+        f"💎 **{tier['emoji']} {tier['name']} VIP Subscription**\n\n"
+        f"💰 ${tier['price']:.0f} for 1 month\n\n"
+        f"**Perks:**\n" +
+        "\n".join(f"  • {p}" for p in tier["perks"]) +
+        f"\n\nClick below to pay. Your VIP access activates **instantly**! ⚡",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="Markdown"
+    )
 
 
 async def cancel_subscription_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -188,13 +221,11 @@ async def cancel_subscription_callback(update: Update, context: ContextTypes.DEF
     await query.answer()
 
     tg_user = update.effective_user
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.telegram_id == tg_user.id).first()
-        if not user:
+    with SessionLocal() as db:
+        user_id, active_sub = _get_user_and_active_sub(db, tg_user.id)
+        if not user_id:
             return
 
-        active_sub = _get_active_sub(db, user.id)
         if not active_sub:
             await query.message.reply_text("You don't have an active subscription.")
             return
@@ -210,8 +241,6 @@ async def cancel_subscription_callback(update: Update, context: ContextTypes.DEF
             f"We'll miss you! You can re-subscribe anytime with /subscribe 💋",
             parse_mode="Markdown"
         )
-    finally:
-        db.close()
 
 
 async def sub_current_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -221,45 +250,54 @@ async def sub_current_callback(update: Update, context: ContextTypes.DEFAULT_TYP
 
 
 def activate_subscription(paypal_order_id: str) -> int:
-    """Activate a subscription after payment. Returns sub ID or 0."""
-    db = SessionLocal()
-    try:
-        sub = (
-            db.query(Subscription)
-            .filter(Subscription.paypal_order_id == paypal_order_id)
-            .first()
-        )
-        if not sub:
-            return 0
-
-        if sub.status == SubscriptionStatus.ACTIVE.value:
-            return sub.id
-
-        now = datetime.datetime.utcnow()
-        sub.status = SubscriptionStatus.ACTIVE.value
-        sub.started_at = now
-        sub.expires_at = now + datetime.timedelta(days=30)
-
-        # Update user's VIP tier
-        user = db.query(User).get(sub.user_id)
-        if user:
-            tier_rank = {"bronze": 1, "silver": 2, "gold": 3}
-            current_rank = tier_rank.get(user.vip_tier, 0)
-            new_rank = tier_rank.get(sub.tier, 0)
-            if new_rank >= current_rank:
-                user.vip_tier = sub.tier
-            user.total_spent += sub.price_monthly
-            user.loyalty_points += int(sub.price_monthly * 15)  # 15 pts/$ for subs (bonus)
-
-        db.commit()
-        logger.info(f"Subscription {sub.id} activated for user {sub.user_id}, tier={sub.tier}")
-        return sub.id
-    except Exception as e:
-        logger.error(f"Subscription activation failed: {e}")
-        db.rollback()
-        return 0
-    finally:
-        db.close()
+    """Activate a subscription after payment. Returns sub ID, or 0 if there
+    is no subscription for the order. Database errors are raised."""
+    with SessionLocal() as db:
+        try:
+            sub = (
+                db.query(Subscription)
+                .filter(Subscription.paypal_order_id == paypal_order_id)
+                # A concurrent webhook retry holding the row gets None here
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if not sub:
+                return 0
+
+            if sub.status == SubscriptionStatus.ACTIVE.value:
+                return sub.id
+
+            now = datetime.datetime.utcnow()
+            sub.status = SubscriptionStatus.ACTIVE.value
+            sub.started_at = now
+            sub.expires_at = now + datetime.timedelta(days=30)
+
+            # Update the user in one UPDATE: atomic increments, and only
+            # raise vip_tier if the user isn't already on a higher tier
+            telegram_id = db.execute(
+                update(User)
+                .where(User.id == sub.user_id)
+                .values(
+                    vip_tier=case(
+                        (or_(User.vip_tier.is_(None), User.vip_tier.notin_(_HIGHER_TIERS.get(sub.tier, ()))), sub.tier),
+                        else_=User.vip_tier,
+                    ),
+                    total_spent=User.total_spent + sub.price_monthly,
+                    loyalty_points=User.loyalty_points + int(sub.price_monthly * 15),  # 15 pts/$ for subs (bonus)
+                )
+                .returning(User.telegram_id)
+            ).scalar()
+
+            sub_id, user_id, tier = sub.id, sub.user_id, sub.tier
+            db.commit()
+            if telegram_id:
+                user_cache.invalidate(telegram_id)
+            logger.info(f"Subscription {sub_id} activated for user {user_id}, tier={tier}")
+            return sub_id
+        except Exception as e:
+            logger.error(f"Subscription activation failed: {e}")
+            db.rollback()
+            raise
 
 
 def get_subscription_handlers():
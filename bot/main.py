@@ -1,5 +1,7 @@
 import logging
 import asyncio
+import datetime
+import orjson
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Response
 from fastapi.responses import HTMLResponse, RedirectResponse
@@ -9,20 +11,26 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import uvicorn
 
 from bot.config import TELEGRAM_BOT_TOKEN, BASE_URL, PORT, PAYPAL_WEBHOOK_ID, ADMIN_PASSWORD
-from bot.models.database import init_db
+from bot.models.database import init_db, log_pool_status
 from bot.handlers.start import get_start_handlers
 from bot.handlers.browse import get_browse_handlers
 from bot.handlers.purchase import get_purchase_handlers
 from bot.handlers.admin import get_admin_handlers
-from bot.handlers.subscription import get_subscription_handlers, activate_subscription
+from bot.handlers.subscription import get_subscription_handlers, activate_subscription, SUB_TIER_TEMPLATES
 from bot.handlers.flash_sales import get_flash_sale_handlers
 from bot.handlers.custom_requests import get_custom_request_handlers
 from bot.handlers.loyalty import get_loyalty_handlers
 from bot.handlers.chat import get_chat_handlers
-from bot.services.paypal import verify_webhook_signature, capture_order as paypal_capture
+from bot.services.paypal import verify_webhook_signature, capture_order as paypal_capture, close as paypal_close
 from bot.services.delivery import deliver_image, complete_order
 from bot.services.drip import process_drip_content, check_flash_sales, check_expiring_subscriptions
-from bot.web.dashboard import router as dashboard_router, process_scheduled_posts, register_auth_exception_handler
+from bot.services.user_cache import flush_last_active
+from bot.services import tg_sender
+from bot.services.instagram import close as instagram_close
+from bot.services.clock import utcnow_1s
+from bot.web.dashboard import (
+    router as dashboard_router, process_scheduled_posts, register_auth_exception_handler, preload_templates,
+)
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -34,39 +42,33 @@ logger = logging.getLogger(__name__)
 tg_app: Application = None
 scheduler: AsyncIOScheduler = None
 
+# PayPal webhook events are acknowledged immediately and processed here
+PAYMENT_WORKERS = 4
+# Shutdown waits this long for queued events before cancelling the workers
+PAYMENT_DRAIN_SECONDS = 15
+payment_queue: asyncio.Queue = None
+payment_workers: list = []
+# False once shutdown starts: new events get a 503 so PayPal redelivers them
+accepting_payments = False
+
 
 def build_telegram_app() -> Application:
     """Build and configure the Telegram bot application."""
     app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
 
-    # Register handlers (order matters — conversation handlers first)
-    for handler in get_admin_handlers():
-        app.add_handler(handler)
-
-    for handler in get_custom_request_handlers():
-        app.add_handler(handler)
-
-    for handler in get_start_handlers():
-        app.add_handler(handler)
-
-    for handler in get_browse_handlers():
-        app.add_handler(handler)
-
-    for handler in get_purchase_handlers():
-        app.add_handler(handler)
-
-    for handler in get_subscription_handlers():
-        app.add_handler(handler)
-
-    for handler in get_flash_sale_handlers():
-        app.add_handler(handler)
-
-    for handler in get_loyalty_handlers():
-        app.add_handler(handler)
-
-    # Chat handler MUST be last — it catches all remaining text messages
-    for handler in get_chat_handlers():
-        app.add_handler(handler)
+    # Register handlers (order matters — conversation handlers first,
+    # chat handler MUST be last — it catches all remaining text messages)
+    app.add_handlers([
+        *get_admin_handlers(),
+        *get_custom_request_handlers(),
+        *get_start_handlers(),
+        *get_browse_handlers(),
+        *get_purchase_handlers(),
+        *get_subscription_handlers(),
+        *get_flash_sale_handlers(),
+        *get_loyalty_handlers(),
+        *get_chat_handlers(),
+    ])
 
     return app
 
@@ -74,11 +76,12 @@ def build_telegram_app() -> Application:
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown logic."""
-    global tg_app, scheduler
+    global tg_app, scheduler, payment_queue, payment_workers, accepting_payments
 
     # Initialize database
     logger.info("Initializing database...")
     init_db()
+    preload_templates()
 
     # Build and initialize Telegram app
     logger.info("Starting Telegram bot...")
@@ -91,33 +94,97 @@ async def lifespan(app: FastAPI):
     await tg_app.bot.set_webhook(url=webhook_url)
     logger.info(f"Webhook set to {webhook_url}")
 
-    # Start scheduler for drip content, flash sales, subscription expiry
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(
-        process_drip_content, "interval", minutes=5, id="drip_content",
-        args=[tg_app.bot],
+    # Start scheduler: one per-minute tick fans out to the periodic jobs
+    # A run that overlaps the next one is skipped rather than stacked
+    scheduler = AsyncIOScheduler(
+        job_defaults={"max_instances": 1, "coalesce": True, "misfire_grace_time": 60},
     )
     scheduler.add_job(
-        check_flash_sales, "interval", minutes=2, id="flash_sales",
+        scheduler_tick, "interval", minutes=1, id="tick",
         args=[tg_app.bot],
     )
     scheduler.add_job(
-        check_expiring_subscriptions, "interval", hours=6, id="sub_expiry",
-        args=[tg_app.bot],
+        flush_last_active, "interval", seconds=30, id="last_active_flush",
     )
     scheduler.add_job(
-        process_scheduled_posts, "interval", minutes=1, id="ig_scheduled_posts",
+        log_pool_status, "interval", minutes=5, id="pool_status",
     )
     scheduler.start()
-    logger.info("Scheduler started (drip: 5min, flash: 2min, subs: 6hr, ig: 1min)")
+    logger.info("Scheduler started (tick: 1min — drip: 5min, flash: 2min, subs: 6hr, ig: 1min; last_active: 30s, pool status: 5min)")
+
+    # Start the rate-limited Telegram sender and PayPal webhook workers
+    tg_sender.start(tg_app.bot)
+    payment_queue = asyncio.Queue()
+    payment_workers = [asyncio.create_task(_payment_worker()) for _ in range(PAYMENT_WORKERS)]
+    accepting_payments = True
 
     yield
 
-    # Shutdown
+    # Shutdown — finish acknowledged payment events before the workers go
     logger.info("Shutting down...")
+    accepting_payments = False
+    try:
+        await asyncio.wait_for(payment_queue.join(), PAYMENT_DRAIN_SECONDS)
+    except asyncio.TimeoutError:
+        pass
+    for task in payment_workers:
+        task.cancel()
+    await asyncio.gather(*payment_workers, return_exceptions=True)
+    unprocessed = []
+    while not payment_queue.empty():
+        _, _, event = payment_queue.get_nowait()
+        unprocessed.append(event.get("id"))
+    if unprocessed:
+        # Resend these from the PayPal dashboard's webhook events page
+        logger.error(f"Shut down with {len(unprocessed)} PayPal events unprocessed: {unprocessed}")
+    await tg_sender.stop()
     scheduler.shutdown(wait=False)
     await tg_app.stop()
     await tg_app.shutdown()
+    await paypal_close()
+    await instagram_close()
+
+
+# How often scheduler_tick runs each job. A job is due once its interval
+# has passed since it last ran, so a tick skipped while an earlier one
+# overran only delays it to the next tick instead of a whole interval.
+TICK_JOB_INTERVALS = {
+    "drip_content": datetime.timedelta(minutes=5),
+    "flash_sales": datetime.timedelta(minutes=2),
+    "sub_expiry": datetime.timedelta(hours=6),
+    "prune_events": datetime.timedelta(days=1),
+}
+_last_job_run: dict[str, datetime.datetime] = {}
+
+
+def _job_due(name: str, now: datetime.datetime) -> bool:
+    """True if the job hasn't run for its interval; records the run."""
+    last = _last_job_run.get(name)
+    # Ticks land a few seconds apart, so allow a little slack
+    if last is not None and now - last < TICK_JOB_INTERVALS[name] - datetime.timedelta(seconds=5):
+        return False
+    _last_job_run[name] = now
+    return True
+
+
+async def scheduler_tick(bot: Bot):
+    """Run whichever periodic jobs are due this minute, concurrently.
+    A failing job is logged and doesn't stop the others."""
+    now = utcnow_1s()
+    jobs = {"ig_scheduled_posts": process_scheduled_posts()}
+    if _job_due("drip_content", now):
+        jobs["drip_content"] = process_drip_content(bot, now)
+    if _job_due("flash_sales", now):
+        jobs["flash_sales"] = check_flash_sales(bot, now)
+    if _job_due("sub_expiry", now):
+        jobs["sub_expiry"] = check_expiring_subscriptions(bot, now)
+    if _job_due("prune_events", now):
+        jobs["prune_events"] = asyncio.to_thread(_prune_processed_events, now)
+
+    results = await asyncio.gather(*jobs.values(), return_exceptions=True)
+    for name, result in zip(jobs, results):
+        if isinstance(result, Exception):
+            logger.error(f"Scheduled job {name} failed: {result}", exc_info=result)
 
 
 # FastAPI app
@@ -139,7 +206,7 @@ async def telegram_webhook(request: Request):
     """Receive Telegram updates via webhook."""
     global tg_app
     try:
-        data = await request.json()
+        data = orjson.loads(await request.body())
         update = Update.de_json(data, tg_app.bot)
         await tg_app.process_update(update)
     except Exception as e:
@@ -152,29 +219,105 @@ async def telegram_webhook(request: Request):
 @web_app.post("/paypal/webhook")
 async def paypal_webhook(request: Request):
     """Handle PayPal payment webhooks — auto-deliver images."""
+    if not accepting_payments:
+        # Shutting down: a non-2xx makes PayPal retry against the next instance
+        return Response(status_code=503)
+
     body = await request.body()
     headers = dict(request.headers)
+    event = orjson.loads(body)
+
+    logger.info(f"PayPal webhook: {event.get('event_type', '')}")
+
+    # Verification, dedup, capture and delivery all run in the payment
+    # workers — the request path only parses and acknowledges
+    payment_queue.put_nowait((headers, body, event))
+    return Response(status_code=200)
 
-    # Verify webhook signature
+
+async def _verify_and_claim(headers: dict, body: bytes, event: dict) -> bool:
+    """Check the signature and record the event id. False means drop it.
+    The claim is released again if processing fails, see _payment_worker."""
     if PAYPAL_WEBHOOK_ID:
         try:
-            valid = await verify_webhook_signature(headers, body, PAYPAL_WEBHOOK_ID)
+            valid = await verify_webhook_signature(headers, event, PAYPAL_WEBHOOK_ID, body)
             if not valid:
-                logger.warning("Invalid PayPal webhook signature")
-                return Response(status_code=400)
+                logger.warning("Invalid PayPal webhook signature, dropping event")
+                return False
         except Exception as e:
             logger.warning(f"Webhook verification failed: {e}")
             # Continue processing in sandbox mode for testing
 
-    import json
-    event = json.loads(body)
-    event_type = event.get("event_type", "")
+    # PayPal retries deliveries — only the first copy of an event is processed
+    event_id = event.get("id")
+    if event_id and not await asyncio.to_thread(_claim_event, event_id):
+        logger.info(f"PayPal webhook {event_id} already processed, skipping")
+        return False
+    return True
+
+
+def _claim_event(event_id: str) -> bool:
+    """Record a webhook event id. Returns False if it was seen before."""
+    from bot.models.database import SessionLocal
+    from bot.models.schemas import ProcessedEvent
+    from sqlalchemy.dialects.postgresql import insert
+
+    with SessionLocal() as db:
+        result = db.execute(
+            insert(ProcessedEvent)
+            .values(event_id=event_id)
+            .on_conflict_do_nothing(index_elements=["event_id"])
+        )
+        db.commit()
+        return result.rowcount == 1
+
+
+def _release_event(event_id: str):
+    """Forget a claimed event whose processing failed, so a redelivery runs."""
+    from bot.models.database import SessionLocal
+    from bot.models.schemas import ProcessedEvent
+
+    try:
+        with SessionLocal() as db:
+            db.query(ProcessedEvent).filter(ProcessedEvent.event_id == event_id).delete()
+            db.commit()
+    except Exception as e:
+        logger.error(f"Could not release PayPal event {event_id}: {e}")
+
+
+# PayPal stops retrying a webhook after 3 days; keep ids well past that
+PROCESSED_EVENT_RETENTION = datetime.timedelta(days=30)
+
+
+def _prune_processed_events(now: datetime.datetime):
+    """Delete processed event ids older than PROCESSED_EVENT_RETENTION."""
+    from bot.models.database import SessionLocal, lift_statement_timeout
+    from bot.models.schemas import ProcessedEvent
+
+    with SessionLocal() as db:
+        lift_statement_timeout(db)
+        pruned = (
+            db.query(ProcessedEvent)
+            .filter(ProcessedEvent.received_at < now - PROCESSED_EVENT_RETENTION)
+            .delete(synchronize_session=False)
+        )
+        db.commit()
+    if pruned:
+        logger.info(f"Pruned {pruned} processed PayPal event ids")
+
+
+def _related_order_id(resource: dict):
+    """The checkout order id a capture belongs to, or None if absent."""
+    try:
+        return resource["supplementary_data"]["related_ids"]["order_id"]
+    except (KeyError, TypeError):
+        return None
 
-    logger.info(f"PayPal webhook: {event_type}")
 
+async def _handle_paypal_event(event_type: str, resource: dict):
+    """Capture and/or fulfil a payment from a queued PayPal webhook event."""
     if event_type == "CHECKOUT.ORDER.APPROVED":
         # User approved the payment — capture it
-        resource = event.get("resource", {})
         paypal_order_id = resource.get("id")
 
         if paypal_order_id:
@@ -186,109 +329,166 @@ async def paypal_webhook(request: Request):
                     await _process_completed_payment(paypal_order_id)
             except Exception as e:
                 logger.error(f"Capture/delivery failed for {paypal_order_id}: {e}")
+                raise
 
     elif event_type == "PAYMENT.CAPTURE.COMPLETED":
-        resource = event.get("resource", {})
-        supplementary = resource.get("supplementary_data", {})
-        related = supplementary.get("related_ids", {})
-        paypal_order_id = related.get("order_id")
+        paypal_order_id = _related_order_id(resource)
 
         if paypal_order_id:
             await _process_completed_payment(paypal_order_id)
 
-    return Response(status_code=200)
+
+async def _payment_worker():
+    """Drain queued PayPal events until cancelled on shutdown.
+    An event that fails after being claimed is un-claimed, so a
+    redelivery of it isn't dropped as a duplicate."""
+    while True:
+        headers, body, event = await payment_queue.get()
+        event_type = event.get("event_type", "")
+        event_id = event.get("id")
+        claimed = False
+        try:
+            claimed = await _verify_and_claim(headers, body, event)
+            if claimed:
+                await _handle_paypal_event(event_type, event.get("resource", {}))
+        except asyncio.CancelledError:
+            if claimed and event_id:
+                _release_event(event_id)  # shutting down, blocking is fine
+            raise
+        except Exception as e:
+            logger.error(f"PayPal event {event_type} failed: {e}", exc_info=True)
+            if claimed and event_id:
+                await asyncio.to_thread(_release_event, event_id)
+        finally:
+            payment_queue.task_done()
+
+
+def _load_activated_sub(sub_id: int):
+    """Return (telegram_id, tier, expires_at) for an activated subscription, or None."""
+    from bot.models.database import SessionLocal
+    from bot.models.schemas import Subscription
+    from bot.services import user_cache
+
+    with SessionLocal() as db:
+        row = (
+            db.query(Subscription.user_id, Subscription.tier, Subscription.expires_at)
+            .filter_by(id=sub_id)
+            .first()
+        )
+        if not row:
+            return None
+        telegram_id = user_cache.telegram_id_for(db, row.user_id)
+        if not telegram_id:
+            return None
+        return telegram_id, row.tier, row.expires_at
+
+
+def _mark_request_paid(paypal_order_id: str):
+    """Mark a custom request as paid. Returns (req_id, price, telegram_id) or None."""
+    from bot.models.database import SessionLocal
+    from bot.models.schemas import CustomRequest, RequestStatus
+    from bot.services import user_cache
+
+    with SessionLocal() as db:
+        req = (
+            db.query(CustomRequest)
+            .filter_by(paypal_order_id=paypal_order_id)
+            .first()
+        )
+        if not req or req.status == RequestStatus.COMPLETED.value:
+            return None
+        req.status = RequestStatus.ACCEPTED.value  # paid, awaiting admin delivery
+        result = (req.id, req.price, user_cache.telegram_id_for(db, req.user_id))
+        db.commit()
+        return result
 
 
 async def _process_completed_payment(paypal_order_id: str):
-    """Route a completed PayPal payment to the right handler."""
+    """Route a completed PayPal payment to the right handler.
+    DB work runs in worker threads so the event loop keeps serving updates."""
     # Try image order first
-    order_id = complete_order(paypal_order_id)
+    order_id = await asyncio.to_thread(complete_order, paypal_order_id)
     if order_id:
         await deliver_image(tg_app.bot, order_id)
         logger.info(f"Image delivered for PayPal order {paypal_order_id}")
         return
 
     # Try subscription activation
-    sub_id = activate_subscription(paypal_order_id)
+    sub_id = await asyncio.to_thread(activate_subscription, paypal_order_id)
     if sub_id:
-        from bot.models.database import SessionLocal
-        from bot.models.schemas import Subscription, User
-        db = SessionLocal()
-        try:
-            sub = db.query(Subscription).get(sub_id)
-            if sub:
-                user = db.query(User).get(sub.user_id)
-                if user:
-                    from bot.handlers.subscription import SUB_TIERS
-                    tier_info = SUB_TIERS.get(sub.tier, {})
-                    try:
-                        await tg_app.bot.send_message(
-                            chat_id=user.telegram_id,
-                            text=(
-                                f"✅ **VIP {tier_info.get('name', sub.tier)} Activated!**\n\n"
-                                f"{tier_info.get('emoji', '💎')} Your perks are now active:\n" +
-                                "\n".join(f"  • {p}" for p in tier_info.get('perks', [])) +
-                                f"\n\nExpires: {sub.expires_at.strftime('%B %d, %Y')}\n"
-                                f"Enjoy your VIP status! 👑"
-                            ),
-                            parse_mode="Markdown"
-                        )
-                    except Exception as e:
-                        logger.warning(f"Failed to notify user of sub activation: {e}")
-        finally:
-            db.close()
+        activated = await asyncio.to_thread(_load_activated_sub, sub_id)
+        if activated:
+            telegram_id, tier, expires_at = activated
+            template = SUB_TIER_TEMPLATES.get(tier)
+            if template:
+                await tg_sender.enqueue_send(
+                    telegram_id,
+                    template.format(expires=expires_at.strftime('%B %d, %Y')),
+                    parse_mode="Markdown"
+                )
         logger.info(f"Subscription {sub_id} activated for PayPal order {paypal_order_id}")
         return
 
     # Try custom request payment
-    from bot.models.database import SessionLocal as SL
-    from bot.models.schemas import CustomRequest, RequestStatus as RS, User as UserModel
-    db = SL()
-    try:
-        req = db.query(CustomRequest).filter(
-            CustomRequest.paypal_order_id == paypal_order_id
-        ).first()
-        if req and req.status != RS.COMPLETED.value:
-            req.status = RS.ACCEPTED.value  # paid, awaiting admin delivery
-            db.commit()
-
-            user_obj = db.query(UserModel).get(req.user_id) if req else None
-            if user_obj:
-                try:
-                    await tg_app.bot.send_message(
-                        chat_id=user_obj.telegram_id,
-                        text=(
-                            f"✅ **Payment received for Request #{req.id}!**\n\n"
-                            f"Your custom content is being created.\n"
-                            f"You'll receive it as soon as it's ready! 🎨"
-                        ),
-                        parse_mode="Markdown"
-                    )
-                except Exception:
-                    pass
-
-            # Notify admin
-            from bot.config import ADMIN_TELEGRAM_ID
-            from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-            try:
-                await tg_app.bot.send_message(
-                    chat_id=ADMIN_TELEGRAM_ID,
-                    text=f"💰 **Request #{req.id} PAID** (${req.price:.2f})\nReady for delivery!",
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
-                        f"📸 Deliver #{req.id}",
-                        callback_data=f"admin_req_deliver_{req.id}"
-                    )]]),
-                    parse_mode="Markdown"
-                )
-            except Exception:
-                pass
-            logger.info(f"Custom request {req.id} paid via {paypal_order_id}")
-    finally:
-        db.close()
+    paid = await asyncio.to_thread(_mark_request_paid, paypal_order_id)
+    if not paid:
+        return
+    req_id, req_price, user_tg_id = paid
+
+    if user_tg_id:
+        await tg_sender.enqueue_send(
+            user_tg_id,
+            f"✅ **Payment received for Request #{req_id}!**\n\n"
+            f"Your custom content is being created.\n"
+            f"You'll receive it as soon as it's ready! 🎨",
+            parse_mode="Markdown"
+        )
+
+    # Notify admin
+    from bot.config import ADMIN_TELEGRAM_ID
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    await tg_sender.enqueue_send(
+        ADMIN_TELEGRAM_ID,
+        f"💰 **Request #{req_id} PAID** (${req_price:.2f})\nReady for delivery!",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+            f"📸 Deliver #{req_id}",
+            callback_data=f"admin_req_deliver_{req_id}"
+        )]]),
+        parse_mode="Markdown"
+    )
+    logger.info(f"Custom request {req_id} paid via {paypal_order_id}")
 
 
 # ─── PayPal Return/Cancel URLs ────────────────────────
 
+# Static pages, encoded once at import
+RETURN_HTML = """
+<html>
+<head><title>Payment Complete</title></head>
+<body style="display:flex;align-items:center;justify-content:center;height:100vh;
+              font-family:Arial,sans-serif;background:#1a1a2e;color:white;text-align:center;">
+    <div>
+        <h1>✅ Payment Successful!</h1>
+        <p>Your image has been sent to you on Telegram.</p>
+        <p>You can close this page now. 💋</p>
+    </div>
+</body>
+</html>
+""".encode()
+
+CANCEL_HTML = """
+<html>
+<head><title>Payment Cancelled</title></head>
+<body style="display:flex;align-items:center;justify-content:center;height:100vh;
+              font-family:Arial,sans-serif;background:#1a1a2e;color:white;text-align:center;">
+    <div>
+        <h1>❌ Payment Cancelled</h1>
+        <p>No worries! Head back to Telegram to continue browsing.</p>
+    </div>
+</body>
+</html>
+""".encode()
+
 @web_app.get("/paypal/return")
 async def paypal_return(request: Request):
     """User redirected here after PayPal approval."""
@@ -303,40 +503,13 @@ async def paypal_return(request: Request):
         except Exception as e:
             logger.error(f"Return capture failed: {e}")
 
-    return HTMLResponse(
-        """
-        <html>
-        <head><title>Payment Complete</title></head>
-        <body style="display:flex;align-items:center;justify-content:center;height:100vh;
-                      font-family:Arial,sans-serif;background:#1a1a2e;color:white;text-align:center;">
-            <div>
-                <h1>✅ Payment Successful!</h1>
-                <p>Your image has been sent to you on Telegram.</p>
-                <p>You can close this page now. 💋</p>
-            </div>
-        </body>
-        </html>
-        """
-    )
+    return HTMLResponse(RETURN_HTML)
 
 
 @web_app.get("/paypal/cancel")
 async def paypal_cancel():
     """User cancelled payment."""
-    return HTMLResponse(
-        """
-        <html>
-        <head><title>Payment Cancelled</title></head>
-        <body style="display:flex;align-items:center;justify-content:center;height:100vh;
-                      font-family:Arial,sans-serif;background:#1a1a2e;color:white;text-align:center;">
-            <div>
-                <h1>❌ Payment Cancelled</h1>
-                <p>No worries! Head back to Telegram to continue browsing.</p>
-            </div>
-        </body>
-        </html>
-        """
-    )
+    return HTMLResponse(CANCEL_HTML)
 
 
 # ─── Health Check ──────────────────────────────────────
@@ -349,4 +522,8 @@ async def health_check():
 # ─── Entry Point ───────────────────────────────────────
 
 if __name__ == "__main__":
-    uvicorn.run("bot.main:web_app", host="0.0.0.0", port=PORT, reload=False)
+    # Single worker: the scheduler, payment queue and caches are in-process
+    uvicorn.run(
+        "bot.main:web_app", host="0.0.0.0", port=PORT, reload=False,
+        loop="uvloop", http="httptools",
+    )
@@ -1,12 +1,60 @@
-from sqlalchemy import create_engine
+import logging
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, declarative_base
-from bot.config import DATABASE_URL
+from bot.config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW
+
+logger = logging.getLogger(__name__)
+
+# At most DB_POOL_SIZE + DB_MAX_OVERFLOW connections (5 + 10 by default). The
+# cap is set by the Postgres plan's connection limit, which this process shares
+# with one-off shells and deploy overlap — not by the number of threads that
+# may want a session; those wait up to pool_timeout for a free connection.
+# Sessions are synchronous: long-running work inside async handlers should
+# go through asyncio.to_thread / run_in_executor so it doesn't block the loop.
+_connect_args = {}
+if DATABASE_URL.startswith("postgresql"):
+    # Fail fast instead of letting one runaway query hold a pooled connection
+    _connect_args["options"] = "-c statement_timeout=5000"
+
+engine = create_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=30,
+    pool_recycle=1800,  # recycle before Render's proxy drops idle connections
+    connect_args=_connect_args,
+)
+
+# Highest number of connections checked out since the last log_pool_status()
+_pool_metrics = {"peak_checked_out": 0}
+
+
+@event.listens_for(engine, "checkout")
+def _on_checkout(dbapi_conn, conn_record, conn_proxy):
+    checked_out = engine.pool.checkedout()
+    if checked_out > _pool_metrics["peak_checked_out"]:
+        _pool_metrics["peak_checked_out"] = checked_out
+
+
+def log_pool_status():
+    """Log pool usage and reset the peak. Called periodically by the scheduler."""
+    logger.info(f"DB pool: {engine.pool.status()} peak_checked_out={_pool_metrics['peak_checked_out']}")
+    _pool_metrics["peak_checked_out"] = engine.pool.checkedout()
+
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_size=5)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 Base = declarative_base()
 
 
+def lift_statement_timeout(conn):
+    """Disable statement_timeout for the rest of the current transaction.
+    For startup migrations and background bulk UPDATEs, which may
+    legitimately run longer than the request-path limit."""
+    if engine.dialect.name == "postgresql":
+        conn.execute(text("SET LOCAL statement_timeout = 0"))
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -19,24 +67,52 @@ def init_db():
     from bot.models.schemas import (
         User, Image, Order, Category,
         Subscription, DripSchedule, FlashSale, CustomRequest, LoyaltyRedemption,
-        ScheduledPost,
+        ScheduledPost, ProcessedEvent,
     )
     Base.metadata.create_all(bind=engine)
     _run_migrations()
 
 
+# Indexes added after the initial schema. create_all() skips tables that
+# already exist, so existing deployments pick these up here.
+_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_orders_user_image_status ON orders (user_id, image_id, status)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_user_status_completed_at ON orders (user_id, status, completed_at DESC)",
+    # Webhook/user lookups — declared on the models, ensured here for older tables
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_telegram_id ON users (telegram_id)",
+    "CREATE INDEX IF NOT EXISTS ix_subscriptions_paypal_order_id ON subscriptions (paypal_order_id)",
+    "CREATE INDEX IF NOT EXISTS ix_custom_requests_paypal_order_id ON custom_requests (paypal_order_id)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_paypal_status ON orders (paypal_order_id, status)",
+    "CREATE INDEX IF NOT EXISTS ix_sched_posts_status_time ON scheduled_posts (status, scheduled_at)",
+    "CREATE INDEX IF NOT EXISTS ix_sched_posts_created ON scheduled_posts (created_at DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_image_ct_active_created ON images (content_type, is_active, created_at DESC)",
+    # Scheduler predicates in services/drip.py
+    "CREATE INDEX IF NOT EXISTS ix_sub_active_exp ON subscriptions (status, expires_at)",
+    "CREATE INDEX IF NOT EXISTS ix_drip_pending ON drip_schedule (send_at) WHERE sent = false",
+    "CREATE INDEX IF NOT EXISTS ix_flash_live ON flash_sales (ends_at) WHERE is_active = true",
+]
+
+
 def _run_migrations():
-    """Add new columns to existing tables if they don't exist yet."""
-    from sqlalchemy import text, inspect
+    """Add new columns and indexes to existing tables if they don't exist yet."""
+    from sqlalchemy import inspect
     insp = inspect(engine)
     if "images" in insp.get_table_names():
         columns = [c["name"] for c in insp.get_columns("images")]
         with engine.begin() as conn:
+            lift_statement_timeout(conn)
             if "file_data" not in columns:
                 conn.execute(text("ALTER TABLE images ADD COLUMN file_data BYTEA"))
             if "file_mimetype" not in columns:
                 conn.execute(text("ALTER TABLE images ADD COLUMN file_mimetype VARCHAR(50)"))
             if "is_explicit" not in columns:
                 conn.execute(text("ALTER TABLE images ADD COLUMN is_explicit BOOLEAN DEFAULT FALSE"))
+            if "telegram_file_id" not in columns:
+                conn.execute(text("ALTER TABLE images ADD COLUMN telegram_file_id VARCHAR(255)"))
             # Make cloudinary_url nullable if it wasn't already
             conn.execute(text("ALTER TABLE images ALTER COLUMN cloudinary_url DROP NOT NULL"))
+
+    with engine.begin() as conn:
+        lift_statement_timeout(conn)
+        for stmt in _INDEXES:
+            conn.execute(text(stmt))
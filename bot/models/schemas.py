@@ -1,9 +1,9 @@
 import datetime
 from sqlalchemy import (
     Column, Integer, BigInteger, String, Float, Boolean,
-    DateTime, ForeignKey, Text, Enum as SAEnum, LargeBinary
+    DateTime, ForeignKey, Text, Enum as SAEnum, LargeBinary, Index
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from bot.models.database import Base
 import enum
 
@@ -88,8 +88,11 @@ class Image(Base):
     price = Column(Float, nullable=False, default=5.0)
     cloudinary_url = Column(Text, nullable=True)  # legacy — kept for backward compat
     cloudinary_public_id = Column(String(255), nullable=True)
-    file_data = Column(LargeBinary, nullable=True)  # image bytes stored in DB
+    # image bytes stored in DB — deferred so list/browse queries don't pull the blob
+    file_data = deferred(Column(LargeBinary, nullable=True))
     file_mimetype = Column(String(50), nullable=True)  # e.g. image/jpeg
+    # Telegram's id for the full image after its first upload — resent by id, not bytes
+    telegram_file_id = Column(String(255), nullable=True)
     content_type = Column(String(20), nullable=False, default=ContentType.PRIVATE.value)  # instagram or private
     is_explicit = Column(Boolean, default=False)  # nude/explicit — blocked from free unlocks
     is_bundle = Column(Boolean, default=False)
@@ -111,6 +114,11 @@ class Image(Base):
     category = relationship("Category", back_populates="images")
     orders = relationship("Order", back_populates="image")
 
+    __table_args__ = (
+        # Dashboard gallery/counters: active images by content type, newest first
+        Index("ix_image_ct_active_created", content_type, is_active, created_at.desc()),
+    )
+
 
 class Order(Base):
     __tablename__ = "orders"
@@ -128,6 +136,15 @@ class Order(Base):
     user = relationship("User", back_populates="orders")
     image = relationship("Image", back_populates="orders")
 
+    __table_args__ = (
+        # Ownership checks: user_id + image_id + status='completed'
+        Index("ix_orders_user_image_status", user_id, image_id, status),
+        # /mypurchases: user's completed orders, newest first
+        Index("ix_orders_user_status_completed_at", user_id, status, completed_at.desc()),
+        # Webhook fulfilment: pending order by PayPal order id
+        Index("ix_orders_paypal_status", paypal_order_id, status),
+    )
+
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
@@ -146,6 +163,11 @@ class Subscription(Base):
 
     user = relationship("User", back_populates="subscriptions")
 
+    __table_args__ = (
+        # Active-subscription checks and the expiry job: status + expires_at range
+        Index("ix_sub_active_exp", status, expires_at),
+    )
+
 
 class DripSchedule(Base):
     __tablename__ = "drip_schedule"
@@ -160,6 +182,11 @@ class DripSchedule(Base):
 
     image = relationship("Image")
 
+    __table_args__ = (
+        # process_drip_content: unsent drips that are due — sent rows are never scanned
+        Index("ix_drip_pending", send_at, postgresql_where=(sent == False)),
+    )
+
 
 class FlashSale(Base):
     __tablename__ = "flash_sales"
@@ -174,6 +201,11 @@ class FlashSale(Base):
     category_id = Column(Integer, ForeignKey("categories.id"), nullable=True)  # null = all categories
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
+    __table_args__ = (
+        # check_flash_sales: live sales to announce and expired ones to deactivate
+        Index("ix_flash_live", ends_at, postgresql_where=(is_active == True)),
+    )
+
 
 class CustomRequest(Base):
     __tablename__ = "custom_requests"
@@ -184,7 +216,7 @@ class CustomRequest(Base):
     price = Column(Float, nullable=True)  # set by admin after review
     status = Column(String(50), default=RequestStatus.PENDING.value)
     admin_notes = Column(Text, nullable=True)
-    paypal_order_id = Column(String(255), nullable=True)
+    paypal_order_id = Column(String(255), nullable=True, index=True)
     result_image_id = Column(Integer, ForeignKey("images.id"), nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
@@ -218,3 +250,18 @@ class ScheduledPost(Base):
     posted_at = Column(DateTime, nullable=True)
 
     image = relationship("Image")
+
+    __table_args__ = (
+        # process_scheduled_posts: pending posts that are due
+        Index("ix_sched_posts_status_time", status, scheduled_at),
+        # Dashboard home: latest scheduled posts, newest first
+        Index("ix_sched_posts_created", created_at.desc()),
+    )
+
+
+class ProcessedEvent(Base):
+    """PayPal webhook event ids already handled — retries are dropped."""
+    __tablename__ = "processed_events"
+
+    event_id = Column(String(255), primary_key=True)
+    received_at = Column(DateTime, default=datetime.datetime.utcnow)
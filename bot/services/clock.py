@@ -0,0 +1,19 @@
+"""
+Coarse UTC clock for hot paths.
+Expiry checks and last_active stamps don't need sub-second precision,
+so the datetime is rebuilt at most once per second.
+"""
+
+import time
+import datetime
+
+_NOW_CACHE = {"t": 0, "dt": None}
+
+
+def utcnow_1s() -> datetime.datetime:
+    """Current naive UTC time, truncated to the second."""
+    b = int(time.time())
+    if b != _NOW_CACHE["t"]:
+        _NOW_CACHE["t"] = b
+        _NOW_CACHE["dt"] = datetime.datetime.utcfromtimestamp(b)
+    return _NOW_CACHE["dt"]
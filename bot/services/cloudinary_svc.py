@@ -1,3 +1,4 @@
+import io
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
@@ -38,8 +39,9 @@ def upload_image(file_path: str, folder: str = "companion_bot/private") -> dict:
 
 
 def upload_image_from_bytes(file_bytes: bytes, filename: str, folder: str = "companion_bot/private") -> dict:
-    """Upload image from bytes (e.g., from Telegram file download)."""
-    import io
+    """Upload image from bytes (e.g., from Telegram file download).
+    BytesIO shares the bytes buffer rather than copying it, and the SDK
+    reads the stream once, so no extra copy of the image is made here."""
     result = cloudinary.uploader.upload(
         io.BytesIO(file_bytes),
         folder=folder,
@@ -1,53 +1,75 @@
+import asyncio
 import logging
 import datetime
+from sqlalchemy import text
 from sqlalchemy.orm import Session
-from bot.models.schemas import Order, Image, User, OrderStatus
+from bot.models.schemas import Order, Image, OrderStatus
 from bot.models.database import SessionLocal
+from bot.services import user_cache
 
 logger = logging.getLogger(__name__)
 
+# Spending thresholds for VIP tiers, highest first
+SPEND_TIERS = ((150, "gold"), (75, "silver"), (25, "bronze"), (0, "free"))
 
-async def deliver_image(bot, order_id: int):
-    """Deliver the purchased image to the user via Telegram."""
-    db = SessionLocal()
-    try:
+
+def compute_tier(total_spent: float) -> str:
+    """VIP tier earned by lifetime spending alone."""
+    return next(tier for threshold, tier in SPEND_TIERS if (total_spent or 0) >= threshold)
+
+
+def full_photo(image: Image):
+    """photo= argument for sending the full image: Telegram's file_id once it
+    has been uploaded, else the Cloudinary URL (Telegram fetches it from the
+    CDN), else the stored bytes. The deferred file_data blob is only loaded
+    when neither of the others exists."""
+    if image.telegram_file_id:
+        return image.telegram_file_id
+    if image.cloudinary_url:
+        return image.cloudinary_url
+    return bytes(image.file_data) if image.file_data else None
+
+
+def remember_file_id(image_id: int, message) -> str | None:
+    """Store the file_id Telegram assigned to an uploaded full image.
+    Returns it, or None if the message carries no photo."""
+    if not message or not message.photo:
+        return None
+    file_id = message.photo[-1].file_id
+    with SessionLocal() as db:
+        db.query(Image).filter(Image.id == image_id).update({"telegram_file_id": file_id})
+        db.commit()
+    return file_id
+
+
+def _load_delivery(order_id: int) -> dict | None:
+    """Snapshot what deliver_image sends. Runs in a worker thread."""
+    with SessionLocal() as db:
         order = db.query(Order).get(order_id)
         if not order:
             logger.error(f"Order {order_id} not found for delivery")
-            return False
+            return None
 
         if order.status != OrderStatus.COMPLETED.value:
             logger.warning(f"Order {order_id} is not completed (status: {order.status})")
-            return False
+            return None
 
-        user = db.query(User).get(order.user_id)
+        telegram_id = user_cache.telegram_id_for(db, order.user_id)
         image = db.query(Image).get(order.image_id)
 
-        if not user or not image:
+        if not telegram_id or not image:
             logger.error(f"User or image not found for order {order_id}")
-            return False
+            return None
 
-        # Send the full image (from DB bytes or legacy cloudinary URL)
-        photo_source = bytes(image.file_data) if image.file_data else image.cloudinary_url
+        # Send the full image (Telegram file_id, legacy cloudinary URL or DB bytes)
+        photo_source = full_photo(image)
         if not photo_source:
             logger.error(f"No image data for image {image.id}")
-            return False
-
-        await bot.send_photo(
-            chat_id=user.telegram_id,
-            photo=photo_source,
-            caption=(
-                f"✅ **Payment received!**\n\n"
-                f"🖼 **{image.title}**\n"
-                f"{image.description or ''}\n\n"
-                f"Enjoy! 💋"
-            ),
-            parse_mode="Markdown"
-        )
+            return None
 
         # Upsell — suggest related content
         related = (
-            db.query(Image)
+            db.query(Image.id, Image.title, Image.price)
             .filter(
                 Image.category_id == image.category_id,
                 Image.id != image.id,
@@ -57,6 +79,40 @@ async def deliver_image(bot, order_id: int):
             .all()
         )
 
+        return {
+            "telegram_id": telegram_id,
+            "image_id": image.id,
+            "title": image.title,
+            "description": image.description,
+            "photo": photo_source,
+            "uploaded": bool(image.telegram_file_id),
+            "related": related,
+        }
+
+
+async def deliver_image(bot, order_id: int):
+    """Deliver the purchased image to the user via Telegram."""
+    try:
+        delivery = await asyncio.to_thread(_load_delivery, order_id)
+        if not delivery:
+            return False
+        telegram_id = delivery["telegram_id"]
+
+        msg = await bot.send_photo(
+            chat_id=telegram_id,
+            photo=delivery["photo"],
+            caption=(
+                f"✅ **Payment received!**\n\n"
+                f"🖼 **{delivery['title']}**\n"
+                f"{delivery['description'] or ''}\n\n"
+                f"Enjoy! 💋"
+            ),
+            parse_mode="Markdown"
+        )
+        if not delivery["uploaded"]:
+            await asyncio.to_thread(remember_file_id, delivery["image_id"], msg)
+
+        related = delivery["related"]
         if related:
             from telegram import InlineKeyboardButton, InlineKeyboardMarkup
             keyboard = [
@@ -71,72 +127,76 @@ async def deliver_image(bot, order_id: int):
             ])
 
             await bot.send_message(
-                chat_id=user.telegram_id,
+                chat_id=telegram_id,
                 text="💡 **You might also like:**",
                 reply_markup=InlineKeyboardMarkup(keyboard),
                 parse_mode="Markdown"
             )
 
-        logger.info(f"Delivered image {image.id} to user {user.telegram_id} (order {order_id})")
+        logger.info(f"Delivered image {delivery['image_id']} to user {telegram_id} (order {order_id})")
         return True
 
     except Exception as e:
         logger.error(f"Delivery failed for order {order_id}: {e}")
         return False
-    finally:
-        db.close()
+
+
+# Order, image and user updates for a completed payment in one statement.
+# Only a not-yet-completed order matches, so a repeated webhook is a no-op.
+_TIER_CASE = " ".join(
+    f"WHEN users.total_spent + o.amount >= {threshold} THEN '{tier}'"
+    for threshold, tier in SPEND_TIERS
+    if tier != "free"
+)
+_COMPLETE_ORDER_SQL = text(f"""
+    WITH o AS (
+        UPDATE orders SET status = :completed, completed_at = :now
+        WHERE paypal_order_id = :paypal_order_id AND status <> :completed
+        RETURNING id, image_id, user_id, amount
+    ), i AS (
+        UPDATE images SET total_sales = images.total_sales + 1
+        FROM o WHERE images.id = o.image_id
+    ), u AS (
+        UPDATE users SET
+            total_spent = users.total_spent + o.amount,
+            loyalty_points = users.loyalty_points + CAST(FLOOR(o.amount * 10) AS INTEGER),
+            vip_tier = CASE {_TIER_CASE} ELSE users.vip_tier END
+        FROM o WHERE users.id = o.user_id
+        RETURNING users.telegram_id
+    )
+    SELECT o.id, (SELECT telegram_id FROM u) FROM o
+""")
 
 
 def complete_order(paypal_order_id: str, capture_id: str = None) -> int:
     """
-    Mark an order as completed after PayPal payment.
-    Returns the order ID or 0 if not found.
+    Mark an order as completed after PayPal payment, crediting image sales,
+    user spend, loyalty points (10/$) and spend-based VIP tier.
+    Returns the order ID, or 0 if there is no pending order for it.
+    Database errors are raised, so the webhook event can be retried.
     """
     db = SessionLocal()
     try:
-        order = (
-            db.query(Order)
-            .filter(Order.paypal_order_id == paypal_order_id)
-            .first()
-        )
+        row = db.execute(_COMPLETE_ORDER_SQL, {
+            "paypal_order_id": paypal_order_id,
+            "completed": OrderStatus.COMPLETED.value,
+            "now": datetime.datetime.utcnow(),
+        }).first()
+        db.commit()
 
-        if not order:
-            logger.error(f"No order found for PayPal order {paypal_order_id}")
+        if not row:
+            logger.info(f"No pending order for PayPal order {paypal_order_id}")
             return 0
 
-        if order.status == OrderStatus.COMPLETED.value:
-            logger.info(f"Order {order.id} already completed")
-            return order.id
-
-        order.status = OrderStatus.COMPLETED.value
-        order.completed_at = datetime.datetime.utcnow()
-
-        # Update image sales count
-        image = db.query(Image).get(order.image_id)
-        if image:
-            image.total_sales += 1
-
-        # Update user stats
-        user = db.query(User).get(order.user_id)
-        if user:
-            user.total_spent += order.amount
-            user.loyalty_points += int(order.amount * 10)  # 10 points per dollar
-
-            # Auto-upgrade VIP tier
-            if user.total_spent >= 150:
-                user.vip_tier = "gold"
-            elif user.total_spent >= 75:
-                user.vip_tier = "silver"
-            elif user.total_spent >= 25:
-                user.vip_tier = "bronze"
-
-        db.commit()
-        logger.info(f"Order {order.id} completed for PayPal order {paypal_order_id}")
-        return order.id
+        order_id, telegram_id = row
+        if telegram_id:
+            user_cache.invalidate(telegram_id)
+        logger.info(f"Order {order_id} completed for PayPal order {paypal_order_id}")
+        return order_id
 
     except Exception as e:
         logger.error(f"Failed to complete order for {paypal_order_id}: {e}")
         db.rollback()
-        return 0
+        raise
     finally:
         db.close()
@@ -1,7 +1,15 @@
+import asyncio
 import logging
 import datetime
+import threading
+from cachetools import TTLCache
+from sqlalchemy import and_, case, select, update
 from sqlalchemy.orm import Session
-from bot.models.database import SessionLocal
+from bot.config import DRIP_STORAGE_CHAT_ID
+from bot.models.database import SessionLocal, lift_statement_timeout
+from bot.services import user_cache, tg_sender
+from bot.services.clock import utcnow_1s
+from bot.services.delivery import full_photo, remember_file_id, SPEND_TIERS
 from bot.models.schemas import (
     DripSchedule, Image, User, Subscription, SubscriptionStatus
 )
@@ -11,41 +19,49 @@ logger = logging.getLogger(__name__)
 TIER_RANK = {"free": 0, "bronze": 1, "silver": 2, "gold": 3}
 
 
-def _user_meets_tier(user: User, required_tier: str, db: Session) -> bool:
-    """Check if user's VIP tier meets the required tier for drip content."""
-    user_rank = TIER_RANK.get(user.vip_tier, 0)
-    required_rank = TIER_RANK.get(required_tier, 0)
-
-    if user_rank >= required_rank:
-        return True
-
-    # Also check active subscription
-    active_sub = (
-        db.query(Subscription)
-        .filter(
-            Subscription.user_id == user.id,
-            Subscription.status == SubscriptionStatus.ACTIVE.value,
-            Subscription.expires_at > datetime.datetime.utcnow(),
+# Broadcast audience, shared by drips and flash sales firing close together.
+# Filled from asyncio.to_thread workers; cachetools isn't thread-safe.
+AUDIENCE_TTL_SECONDS = 60
+_audience: TTLCache = TTLCache(maxsize=1, ttl=AUDIENCE_TTL_SECONDS)
+_audience_lock = threading.Lock()
+
+
+def _effective_ranks(db: Session, now: datetime.datetime) -> dict[int, int]:
+    """Map each non-banned user's telegram_id to their effective tier rank —
+    the higher of their VIP tier and any active subscription.
+    Tiers are cached for AUDIENCE_TTL_SECONDS; bans are read fresh every call
+    so a just-banned user never gets a broadcast."""
+    with _audience_lock:
+        ranks = _audience.get("ranks")
+    if ranks is None:
+        rows = (
+            db.query(User.telegram_id, User.vip_tier, Subscription.tier)
+            .outerjoin(
+                Subscription,
+                and_(
+                    Subscription.user_id == User.id,
+                    Subscription.status == SubscriptionStatus.ACTIVE.value,
+                    Subscription.expires_at > now,
+                ),
+            )
         )
-        .first()
-    )
-    if active_sub:
-        sub_rank = TIER_RANK.get(active_sub.tier, 0)
-        if sub_rank >= required_rank:
-            return True
-
-    return False
-
-
-async def process_drip_content(bot):
-    """
-    Check for drip content that needs to be sent.
-    Called periodically by the scheduler.
-    """
-    db = SessionLocal()
-    try:
-        now = datetime.datetime.utcnow()
-
+        ranks = {}
+        for telegram_id, vip_tier, sub_tier in rows:
+            rank = max(TIER_RANK.get(vip_tier, 0), TIER_RANK.get(sub_tier, 0))
+            if rank > ranks.get(telegram_id, -1):
+                ranks[telegram_id] = rank
+        with _audience_lock:
+            _audience["ranks"] = ranks
+
+    banned = {tid for (tid,) in db.query(User.telegram_id).filter(User.is_banned == True)}
+    if not banned:
+        return ranks
+    return {tid: rank for tid, rank in ranks.items() if tid not in banned}
+
+
+def _load_due_drips(now: datetime.datetime) -> list[dict]:
+    """Snapshot due drip items and their recipients. Runs in a worker thread."""
+    with SessionLocal() as db:
         # Get all unsent drip items that are due
         due_drips = (
             db.query(DripSchedule)
@@ -57,89 +73,171 @@ async def process_drip_content(bot):
         )
 
         if not due_drips:
-            return
+            return []
 
         logger.info(f"Processing {len(due_drips)} drip content items")
 
+        images = {
+            img.id: (img, has_bytes)
+            for img, has_bytes in (
+                db.query(Image, Image.file_data.isnot(None))
+                .filter(Image.id.in_({d.image_id for d in due_drips}))
+            )
+        }
+
+        # Every user's tier, resolved once for all due drips
+        ranks = _effective_ranks(db, now)
+
+        items = []
+        missing = []
         for drip in due_drips:
-            image = db.query(Image).get(drip.image_id)
-            if not image:
-                drip.sent = True
-                db.commit()
+            if drip.image_id not in images:
+                missing.append(drip.id)
                 continue
+            image, has_bytes = images[drip.image_id]
 
-            required_tier = drip.tier_required or "free"
-
-            # Get all eligible users
-            users = db.query(User).filter(User.is_banned == False).all()
-
-            sent_count = 0
-            for user in users:
-                if not _user_meets_tier(user, required_tier, db):
-                    continue
-
-                try:
-                    teaser = drip.message_text or f"Here's something special for you... 💋"
-
-                    if required_tier == "free":
-                        # Free drip: send preview + CTA to buy
-                        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-                        keyboard = [[
-                            InlineKeyboardButton(
-                                f"🔓 Unlock Full Image — ${image.price:.2f}",
-                                callback_data=f"img_{image.id}"
-                            )
-                        ]]
-                        photo_src = bytes(image.file_data) if image.file_data else (image.preview_url or image.cloudinary_url)
-                        await bot.send_photo(
-                            chat_id=user.telegram_id,
-                            photo=photo_src,
-                            caption=f"🔥 **New Drop!**\n\n{teaser}\n\n{image.title}",
-                            reply_markup=InlineKeyboardMarkup(keyboard),
-                            parse_mode="Markdown"
-                        )
-                    else:
-                        # Paid tier drip: send full image as perk
-                        photo_src = bytes(image.file_data) if image.file_data else image.cloudinary_url
-                        await bot.send_photo(
-                            chat_id=user.telegram_id,
-                            photo=photo_src,
-                            caption=(
-                                f"💎 **VIP Exclusive Drop!**\n\n"
-                                f"{teaser}\n\n"
-                                f"🖼 {image.title}\n"
-                                f"This is a perk of your VIP membership 👑"
-                            ),
-                            parse_mode="Markdown"
-                        )
-
-                    sent_count += 1
-                except Exception as e:
-                    logger.warning(f"Failed to send drip to {user.telegram_id}: {e}")
-
-            drip.sent = True
+            # One bad drip is set aside instead of failing the whole batch
+            try:
+                required_tier = drip.tier_required or "free"
+
+                # Get all eligible users
+                required_rank = TIER_RANK.get(required_tier, 0)
+                recipients = [tid for tid, rank in ranks.items() if rank >= required_rank]
+
+                if required_tier == "free" and not has_bytes:
+                    # Free drip without stored bytes: send the hosted image by URL
+                    photo, reusable = image.cloudinary_url, False
+                else:
+                    photo, reusable = full_photo(image), not image.telegram_file_id
+
+                items.append({
+                    "drip_id": drip.id,
+                    "required_tier": required_tier,
+                    "teaser": drip.message_text or f"Here's something special for you... 💋",
+                    "image_id": image.id,
+                    "title": image.title,
+                    "price": image.price,
+                    "photo": photo,
+                    # True if the first send should record Telegram's file_id
+                    "upload_once": reusable,
+                    "recipients": recipients,
+                })
+            except Exception as e:
+                logger.error(f"Drip {drip.id} skipped: {e}")
+                missing.append(drip.id)
+
+        # Drips whose image was deleted or couldn't be prepared will never send
+        if missing:
+            db.execute(update(DripSchedule).where(DripSchedule.id.in_(missing)).values(sent=True))
             db.commit()
-            logger.info(f"Drip {drip.id} sent to {sent_count} users")
+        return items
+
+
+def _mark_drips_sent(drip_ids: list[int]):
+    """Flag a batch of drips as sent in one UPDATE."""
+    with SessionLocal() as db:
+        lift_statement_timeout(db)
+        db.execute(update(DripSchedule).where(DripSchedule.id.in_(drip_ids)).values(sent=True))
+        db.commit()
 
+
+async def _copy_drip(bot, item: dict, caption: str, markup) -> bool:
+    """Post the drip once to DRIP_STORAGE_CHAT_ID and queue copies of that
+    message to every recipient. Returns False if the storage post failed."""
+    try:
+        stored = await bot.send_photo(
+            chat_id=DRIP_STORAGE_CHAT_ID, photo=item["photo"],
+            caption=caption, parse_mode="Markdown",
+        )
     except Exception as e:
-        logger.error(f"Drip processing error: {e}")
-    finally:
-        db.close()
+        logger.warning(f"Drip {item['drip_id']} storage post failed, sending directly: {e}")
+        return False
+
+    if item["upload_once"]:
+        await asyncio.to_thread(remember_file_id, item["image_id"], stored)
+    for telegram_id in item["recipients"]:
+        await tg_sender.enqueue_copy(
+            telegram_id, DRIP_STORAGE_CHAT_ID, stored.message_id, reply_markup=markup
+        )
+    return True
+
+
+async def _send_drip(bot, item: dict, caption: str, markup):
+    """Queue a send_photo per recipient, by file_id once Telegram has the image."""
+    recipients = item["recipients"]
+    photo = item["photo"]
+    if item["upload_once"] and recipients:
+        # Upload once, then everyone else gets the file_id
+        try:
+            msg = await bot.send_photo(
+                chat_id=recipients[0], photo=photo, caption=caption,
+                reply_markup=markup, parse_mode="Markdown",
+            )
+            recipients = recipients[1:]
+            photo = await asyncio.to_thread(remember_file_id, item["image_id"], msg) or photo
+        except Exception as e:
+            logger.warning(f"Drip {item['drip_id']} upload failed, uploading per recipient: {e}")
+
+    for telegram_id in recipients:
+        await tg_sender.enqueue_send_photo(
+            telegram_id,
+            photo,
+            caption=caption,
+            reply_markup=markup,
+            parse_mode="Markdown"
+        )
 
 
-async def check_flash_sales(bot):
+async def process_drip_content(bot, now: datetime.datetime = None):
     """
-    Check for flash sales that need announcements.
-    Called periodically by the scheduler.
+    Check for drip content that needs to be sent.
+    Called periodically by the scheduler. DB work runs in worker threads.
     """
-    from bot.models.schemas import FlashSale, Category
-    db = SessionLocal()
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    now = now or utcnow_1s()
     try:
-        now = datetime.datetime.utcnow()
+        items = await asyncio.to_thread(_load_due_drips, now)
+
+        for item in items:
+            teaser = item["teaser"]
+            if item["required_tier"] == "free":
+                # Free drip: send preview + CTA to buy
+                caption = f"🔥 **New Drop!**\n\n{teaser}\n\n{item['title']}"
+                markup = InlineKeyboardMarkup([[
+                    InlineKeyboardButton(
+                        f"🔓 Unlock Full Image — ${item['price']:.2f}",
+                        callback_data=f"img_{item['image_id']}"
+                    )
+                ]])
+            else:
+                # Paid tier drip: send full image as perk
+                caption = (
+                    f"💎 **VIP Exclusive Drop!**\n\n"
+                    f"{teaser}\n\n"
+                    f"🖼 {item['title']}\n"
+                    f"This is a perk of your VIP membership 👑"
+                )
+                markup = None
+
+            if not (DRIP_STORAGE_CHAT_ID and await _copy_drip(bot, item, caption, markup)):
+                await _send_drip(bot, item, caption, markup)
+            logger.info(f"Drip {item['drip_id']} queued for {len(item['recipients'])} users")
+
+        if items:
+            await asyncio.to_thread(_mark_drips_sent, [item["drip_id"] for item in items])
+
+    except Exception as e:
+        logger.error(f"Drip processing error: {e}")
+
 
-        # Find active flash sales that haven't been announced
+def _load_flash_sale_announcements(now: datetime.datetime) -> list[tuple]:
+    """Build (sale_id, text, telegram_ids) for each sale that needs announcing."""
+    from bot.models.schemas import FlashSale, Category
+    with SessionLocal() as db:
+        # Find active flash sales that haven't been announced, with their category
         sales = (
-            db.query(FlashSale)
+            db.query(FlashSale, Category)
+            .outerjoin(Category, Category.id == FlashSale.category_id)
             .filter(
                 FlashSale.is_active == True,
                 FlashSale.announcement_sent == False,
@@ -149,17 +247,22 @@ async def check_flash_sales(bot):
             .all()
         )
 
-        for sale in sales:
+        if not sales:
+            return []
+
+        # Same audience for every sale
+        telegram_ids = list(_effective_ranks(db, now))
+
+        announcements = []
+        for sale, cat in sales:
             # Calculate time remaining
             remaining = sale.ends_at - now
             hours_left = int(remaining.total_seconds() / 3600)
             mins_left = int((remaining.total_seconds() % 3600) / 60)
 
             cat_name = "All Categories"
-            if sale.category_id:
-                cat = db.query(Category).get(sale.category_id)
-                if cat:
-                    cat_name = f"{cat.emoji or ''} {cat.name}"
+            if cat:
+                cat_name = f"{cat.emoji or ''} {cat.name}"
 
             text = (
                 f"⚡ **FLASH SALE!** ⚡\n\n"
@@ -169,58 +272,68 @@ async def check_flash_sales(bot):
                 f"Don't miss out! 🔥"
             )
 
-            from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-            keyboard = [[
-                InlineKeyboardButton("🛒 Shop Now", callback_data="browse_categories")
-            ]]
-
-            users = db.query(User).filter(User.is_banned == False).all()
-            for user in users:
-                try:
-                    await bot.send_message(
-                        chat_id=user.telegram_id,
-                        text=text,
-                        reply_markup=InlineKeyboardMarkup(keyboard),
-                        parse_mode="Markdown"
-                    )
-                except Exception:
-                    pass
+            announcements.append((sale.id, text, telegram_ids))
+        return announcements
 
-            sale.announcement_sent = True
-            db.commit()
-            logger.info(f"Flash sale {sale.id} announced to {len(users)} users")
 
-        # Auto-deactivate expired flash sales
-        expired = (
-            db.query(FlashSale)
-            .filter(
-                FlashSale.is_active == True,
-                FlashSale.ends_at <= now,
+def _finish_flash_sales(announced_ids: list[int], now: datetime.datetime):
+    """Flag announced sales and auto-deactivate expired ones in one commit."""
+    from bot.models.schemas import FlashSale
+    with SessionLocal() as db:
+        if announced_ids:
+            db.execute(
+                update(FlashSale)
+                .where(FlashSale.id.in_(announced_ids))
+                .values(announcement_sent=True)
             )
-            .all()
-        )
-        for sale in expired:
-            sale.is_active = False
+        expired = db.execute(
+            update(FlashSale)
+            .where(FlashSale.is_active == True, FlashSale.ends_at <= now)
+            .values(is_active=False)
+        ).rowcount
+        db.commit()
         if expired:
-            db.commit()
-            logger.info(f"Deactivated {len(expired)} expired flash sales")
+            logger.info(f"Deactivated {expired} expired flash sales")
+
+
+async def check_flash_sales(bot, now: datetime.datetime = None):
+    """
+    Check for flash sales that need announcements.
+    Called periodically by the scheduler. DB work runs in worker threads.
+    """
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    now = now or utcnow_1s()
+    try:
+        announcements = await asyncio.to_thread(_load_flash_sale_announcements, now)
+
+        markup = InlineKeyboardMarkup([[
+            InlineKeyboardButton("🛒 Shop Now", callback_data="browse_categories")
+        ]])
+        for sale_id, text, telegram_ids in announcements:
+            for telegram_id in telegram_ids:
+                await tg_sender.enqueue_send(
+                    telegram_id, text, reply_markup=markup, parse_mode="Markdown"
+                )
+
+            logger.info(f"Flash sale {sale_id} announcement queued for {len(telegram_ids)} users")
+
+        await asyncio.to_thread(
+            _finish_flash_sales, [sale_id for sale_id, _, _ in announcements], now
+        )
 
     except Exception as e:
         logger.error(f"Flash sale check error: {e}")
-    finally:
-        db.close()
 
 
-async def check_expiring_subscriptions(bot):
-    """Notify users whose subscriptions are expiring soon."""
-    db = SessionLocal()
-    try:
-        now = datetime.datetime.utcnow()
+def _load_expiring_subscriptions(now: datetime.datetime) -> list[tuple]:
+    """(telegram_id, tier) for subscriptions expiring in the next 24 hours."""
+    with SessionLocal() as db:
         tomorrow = now + datetime.timedelta(days=1)
 
-        # Find subscriptions expiring in the next 24 hours
-        expiring = (
-            db.query(Subscription)
+        return (
+            db.query(User.telegram_id, Subscription.tier)
+            .select_from(Subscription)
+            .join(User, User.id == Subscription.user_id)
             .filter(
                 Subscription.status == SubscriptionStatus.ACTIVE.value,
                 Subscription.expires_at <= tomorrow,
@@ -229,71 +342,77 @@ async def check_expiring_subscriptions(bot):
             .all()
         )
 
-        for sub in expiring:
-            user = db.query(User).get(sub.user_id)
-            if not user:
-                continue
-
-            from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-            keyboard = [[
-                InlineKeyboardButton("🔄 Renew Now", callback_data=f"sub_{sub.tier}")
-            ]]
-
-            try:
-                await bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=(
-                        f"⚠️ **Your VIP subscription expires tomorrow!**\n\n"
-                        f"Don't lose your {sub.tier.title()} perks!\n"
-                        f"Renew now to keep your discounts and exclusive access.\n\n"
-                        f"💡 Tap below to renew instantly."
-                    ),
-                    reply_markup=InlineKeyboardMarkup(keyboard),
-                    parse_mode="Markdown"
-                )
-            except Exception as e:
-                logger.warning(f"Failed to notify expiring sub for user {user.telegram_id}: {e}")
 
-        # Expire overdue subscriptions
-        overdue = (
-            db.query(Subscription)
-            .filter(
+def _expire_overdue_subscriptions(now: datetime.datetime):
+    """Expire overdue subscriptions and revert tiers of users left without one.
+    Two UPDATEs in one transaction — no per-subscription round-trips."""
+    with SessionLocal() as db:
+        lift_statement_timeout(db)
+        expired_user_ids = db.execute(
+            update(Subscription)
+            .where(
                 Subscription.status == SubscriptionStatus.ACTIVE.value,
                 Subscription.expires_at <= now,
             )
-            .all()
+            .values(status=SubscriptionStatus.EXPIRED.value)
+            .returning(Subscription.user_id)
+        ).scalars().all()
+        if not expired_user_ids:
+            return
+
+        # Revert to spending-based tier unless another subscription is still active
+        still_active = (
+            select(Subscription.id)
+            .where(
+                Subscription.user_id == User.id,
+                Subscription.status == SubscriptionStatus.ACTIVE.value,
+                Subscription.expires_at > now,
+            )
+            .exists()
         )
-        for sub in overdue:
-            sub.status = SubscriptionStatus.EXPIRED.value
-            # Reset user tier if no other active sub
-            user = db.query(User).get(sub.user_id)
-            if user:
-                other_active = (
-                    db.query(Subscription)
-                    .filter(
-                        Subscription.user_id == user.id,
-                        Subscription.id != sub.id,
-                        Subscription.status == SubscriptionStatus.ACTIVE.value,
-                        Subscription.expires_at > now,
-                    )
-                    .first()
+        reverted = db.execute(
+            update(User)
+            .where(User.id.in_(set(expired_user_ids)), ~still_active)
+            .values(vip_tier=case(
+                *((User.total_spent >= threshold, tier) for threshold, tier in SPEND_TIERS if tier != "free"),
+                else_="free",
+            ))
+            .returning(User.telegram_id)
+        ).scalars().all()
+        db.commit()
+
+        for telegram_id in reverted:
+            user_cache.invalidate(telegram_id)
+        logger.info(f"Expired {len(expired_user_ids)} subscriptions")
+
+
+async def check_expiring_subscriptions(bot, now: datetime.datetime = None):
+    """Notify users whose subscriptions are expiring soon."""
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    now = now or utcnow_1s()
+    try:
+        expiring = await asyncio.to_thread(_load_expiring_subscriptions, now)
+
+        # One notice text and keyboard per tier, shared by all its subscribers
+        notices = {}
+        for telegram_id, tier in expiring:
+            if tier not in notices:
+                notices[tier] = (
+                    f"⚠️ **Your VIP subscription expires tomorrow!**\n\n"
+                    f"Don't lose your {tier.title()} perks!\n"
+                    f"Renew now to keep your discounts and exclusive access.\n\n"
+                    f"💡 Tap below to renew instantly.",
+                    InlineKeyboardMarkup([[
+                        InlineKeyboardButton("🔄 Renew Now", callback_data=f"sub_{tier}")
+                    ]]),
                 )
-                if not other_active:
-                    # Revert to spending-based tier
-                    if user.total_spent >= 150:
-                        user.vip_tier = "gold"
-                    elif user.total_spent >= 75:
-                        user.vip_tier = "silver"
-                    elif user.total_spent >= 25:
-                        user.vip_tier = "bronze"
-                    else:
-                        user.vip_tier = "free"
-
-        if overdue:
-            db.commit()
-            logger.info(f"Expired {len(overdue)} subscriptions")
+            text, markup = notices[tier]
+
+            await tg_sender.enqueue_send(
+                telegram_id, text, reply_markup=markup, parse_mode="Markdown"
+            )
+
+        await asyncio.to_thread(_expire_overdue_subscriptions, now)
 
     except Exception as e:
         logger.error(f"Subscription expiry check error: {e}")
-    finally:
-        db.close()
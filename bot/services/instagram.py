@@ -17,6 +17,20 @@ from bot.models.schemas import Image, ContentType
 
 logger = logging.getLogger(__name__)
 
+GRAPH_API_BASE = "https://graph.facebook.com/v18.0"
+
+# Shared keep-alive client for Graph API calls, like the PayPal client
+_CLIENT = httpx.AsyncClient(
+    base_url=GRAPH_API_BASE,
+    timeout=30,
+    limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+)
+
+
+async def close():
+    """Close the shared HTTP client. Called on app shutdown."""
+    await _CLIENT.aclose()
+
 
 class InstagramSafetyError(Exception):
     """Raised when attempting to post non-Instagram content."""
@@ -42,13 +56,25 @@ def _assert_safe_for_instagram(image: Image) -> None:
 async def _ai_verify_safe_for_instagram(image: Image) -> None:
     """AI Vision safety check — scans actual image content before posting.
     This catches images that were mislabeled as 'instagram' but contain NSFW content."""
-    if not image.file_data:
+    from bot.services.nudity_check import classify_image
+
+    # Check what Instagram will fetch: the Cloudinary URL if set, else our bytes
+    result = None
+    if image.cloudinary_url:
+        result = await classify_image(image_url=image.cloudinary_url)
+    if (result is None or not result.classified) and image.file_data:
+        # OpenAI may be unable to fetch the URL — retry with the stored bytes
+        result = await classify_image(image.file_data, image.file_mimetype or "image/jpeg")
+    if result is None:
         logger.warning(f"Image #{image.id} has no file_data — skipping AI safety check")
         return
 
-    from bot.services.nudity_check import classify_image
-    result = await classify_image(image.file_data, image.file_mimetype or "image/jpeg")
-
+    # Fail closed: an image the AI couldn't look at is never posted
+    if not result.classified:
+        raise InstagramSafetyError(
+            f"AI BLOCKED: Image #{image.id} ('{image.title}') could not be classified. "
+            f"It will not be posted to Instagram until the AI check succeeds."
+        )
     if result.is_explicit:
         raise InstagramSafetyError(
             f"AI BLOCKED: Image #{image.id} ('{image.title}') was detected as explicit by AI vision. "
@@ -117,51 +143,48 @@ async def post_to_instagram(
     _assert_safe_for_instagram(image)        # metadata check
     await _ai_verify_safe_for_instagram(image)  # AI vision scan of actual pixels
 
-    api_base = "https://graph.facebook.com/v18.0"
-
-    async with httpx.AsyncClient(timeout=30) as client:
-        # Step 1: Create media container
-        container_resp = await client.post(
-            f"{api_base}/{ig_user_id}/media",
-            params={
-                "image_url": image.cloudinary_url or f"{BASE_URL}/dashboard/images/{image.id}/file",
-                "caption": caption,
-                "access_token": ig_access_token,
-            }
-        )
-        container_data = container_resp.json()
-
-        if "id" not in container_data:
-            error = container_data.get("error", {}).get("message", "Unknown error")
-            logger.error(f"Instagram container creation failed: {error}")
-            return {"error": error}
-
-        creation_id = container_data["id"]
-        logger.info(f"Instagram container created: {creation_id} for image #{image.id}")
-
-        # Step 2: Publish the container
-        publish_resp = await client.post(
-            f"{api_base}/{ig_user_id}/media_publish",
-            params={
-                "creation_id": creation_id,
-                "access_token": ig_access_token,
-            }
-        )
-        publish_data = publish_resp.json()
+    # Step 1: Create media container
+    container_resp = await _CLIENT.post(
+        f"/{ig_user_id}/media",
+        params={
+            "image_url": image.cloudinary_url or f"{BASE_URL}/dashboard/images/{image.id}/file",
+            "caption": caption,
+            "access_token": ig_access_token,
+        }
+    )
+    container_data = container_resp.json()
 
-        if "id" not in publish_data:
-            error = publish_data.get("error", {}).get("message", "Unknown error")
-            logger.error(f"Instagram publish failed: {error}")
-            return {"error": error}
+    if "id" not in container_data:
+        error = container_data.get("error", {}).get("message", "Unknown error")
+        logger.error(f"Instagram container creation failed: {error}")
+        return {"error": error}
 
-        media_id = publish_data["id"]
-        logger.info(f"Instagram post published: {media_id} for image #{image.id}")
+    creation_id = container_data["id"]
+    logger.info(f"Instagram container created: {creation_id} for image #{image.id}")
 
-        return {
+    # Step 2: Publish the container
+    publish_resp = await _CLIENT.post(
+        f"/{ig_user_id}/media_publish",
+        params={
             "creation_id": creation_id,
-            "media_id": media_id,
-            "success": True,
+            "access_token": ig_access_token,
         }
+    )
+    publish_data = publish_resp.json()
+
+    if "id" not in publish_data:
+        error = publish_data.get("error", {}).get("message", "Unknown error")
+        logger.error(f"Instagram publish failed: {error}")
+        return {"error": error}
+
+    media_id = publish_data["id"]
+    logger.info(f"Instagram post published: {media_id} for image #{image.id}")
+
+    return {
+        "creation_id": creation_id,
+        "media_id": media_id,
+        "success": True,
+    }
 
 
 async def post_image_by_id(
@@ -4,9 +4,10 @@ Detects nudity AND apparel/category in a single API call.
 Used during bulk upload to auto-flag explicit images and auto-assign categories.
 """
 
-import json
 import base64
+import asyncio
 import logging
+import orjson
 from dataclasses import dataclass
 from openai import AsyncOpenAI
 from bot.config import OPENAI_API_KEY
@@ -36,17 +37,27 @@ CLASSIFY_PROMPT = (
 class ImageClassification:
     is_explicit: bool
     category_key: str  # "lingerie", "lifestyle", "exclusive", "instagram"
+    classified: bool = True  # False if the API call failed; is_explicit is then a guess
 
 
-async def classify_image(image_bytes: bytes, mimetype: str = "image/jpeg") -> ImageClassification:
-    """Classify an image for nudity and category in one API call."""
+async def classify_image(
+    image_bytes: bytes | None = None,
+    mimetype: str = "image/jpeg",
+    image_url: str | None = None,
+) -> ImageClassification:
+    """Classify an image for nudity and category in one API call.
+    Pass image_url when the image is already hosted — OpenAI fetches it and
+    the bytes aren't base64-encoded into the request."""
     if not client:
         logger.warning("OpenAI client not configured — skipping classification")
         return ImageClassification(is_explicit=False, category_key="exclusive")
 
     try:
-        media_type = mimetype if mimetype.startswith("image/") else "image/jpeg"
-        b64 = base64.b64encode(image_bytes).decode("utf-8")
+        if image_url:
+            url = image_url
+        else:
+            media_type = mimetype if mimetype.startswith("image/") else "image/jpeg"
+            url = f"data:{media_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
 
         response = await client.chat.completions.create(
             model="gpt-4o-mini",
@@ -58,7 +69,7 @@ async def classify_image(image_bytes: bytes, mimetype: str = "image/jpeg") -> Im
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:{media_type};base64,{b64}",
+                                "url": url,
                                 "detail": "low",
                             },
                         },
@@ -73,7 +84,7 @@ async def classify_image(image_bytes: bytes, mimetype: str = "image/jpeg") -> Im
         if raw.startswith("```"):
             raw = raw.split("\n", 1)[-1].rsplit("```", 1)[0].strip()
 
-        data = json.loads(raw)
+        data = orjson.loads(raw)
         result = ImageClassification(
             is_explicit=bool(data.get("explicit", False)),
             category_key=data.get("category", "exclusive"),
@@ -83,7 +94,19 @@ async def classify_image(image_bytes: bytes, mimetype: str = "image/jpeg") -> Im
 
     except Exception as e:
         logger.error(f"Image classification failed: {e}")
-        return ImageClassification(is_explicit=False, category_key="exclusive")
+        return ImageClassification(is_explicit=False, category_key="exclusive", classified=False)
+
+
+async def classify_images_bulk(items: list[tuple[bytes, str]], concurrency: int = 8) -> list[ImageClassification]:
+    """Classify (image_bytes, mimetype) pairs concurrently, at most
+    `concurrency` requests in flight. Results are in input order."""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(image_bytes: bytes, mimetype: str) -> ImageClassification:
+        async with sem:
+            return await classify_image(image_bytes, mimetype)
+
+    return await asyncio.gather(*(one(b, m) for b, m in items))
 
 
 # Keep backward-compatible alias
@@ -4,9 +4,16 @@ Maintains per-user conversation history in memory for context.
 Uses function calling to detect purchase intent and trigger payments.
 """
 
-import json
+import re
+import uuid
+import random
+import asyncio
 import logging
-from collections import defaultdict
+import orjson
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from cachetools import LRUCache
 from openai import AsyncOpenAI
 
 from bot.config import OPENAI_API_KEY, OPENAI_MODEL
@@ -98,9 +105,162 @@ TOOLS = [
     }
 ]
 
-# Per-user conversation history (in-memory, resets on restart)
+# Per-user conversation history (in-memory, resets on restart).
+# Least recently active users are evicted past MAX_USERS.
 MAX_HISTORY = 20
-_histories: dict[int, list[dict]] = defaultdict(list)
+MAX_USERS = 10_000
+# Rough cap on history prompt tokens; long messages push out old turns sooner
+HISTORY_TOKEN_BUDGET = 2000
+_histories: LRUCache = LRUCache(maxsize=MAX_USERS)
+# One lock per user: concurrent messages from the same user take turns,
+# so each reply is generated from (and appended to) a consistent history
+_locks: LRUCache = LRUCache(maxsize=MAX_USERS)
+
+
+def _get_history(user_id: int) -> deque:
+    """Return the user's history, starting an empty one if needed.
+    The deque drops the oldest message once MAX_HISTORY is reached."""
+    history = _histories.get(user_id)
+    if history is None:
+        history = _histories[user_id] = deque(maxlen=MAX_HISTORY)
+    return history
+
+
+def _approx_tokens(message: dict) -> int:
+    # ~4 characters per token for English text, plus per-message overhead
+    return len(message.get("content") or "") // 4 + 4
+
+
+def _trim_history(history: deque) -> None:
+    """Drop the oldest messages until history fits HISTORY_TOKEN_BUDGET.
+    The newest message is always kept, and a tool result is never left
+    at the front without the assistant tool call it answers."""
+    total = sum(_approx_tokens(m) for m in history)
+    while total > HISTORY_TOKEN_BUDGET and len(history) > 1:
+        total -= _approx_tokens(history.popleft())
+    while len(history) > 1 and history[0]["role"] == "tool":
+        history.popleft()
+
+
+def _user_lock(user_id: int) -> asyncio.Lock:
+    lock = _locks.get(user_id)
+    if lock is None:
+        lock = _locks[user_id] = asyncio.Lock()
+    return lock
+
+
+@asynccontextmanager
+async def conversation_turn(user_id: int):
+    """Hold the user's history lock for one whole turn: chat() and, for an
+    offer, everything up to get_post_offer_reply() or withdraw_offer().
+    A message arriving mid-offer then can't land between the assistant
+    tool call and its tool result, which OpenAI would reject."""
+    async with _user_lock(user_id):
+        yield
+
+
+# The persona is sent first and byte-identical on every turn so OpenAI's
+# prompt caching can reuse it; per-user details go after it
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+
+def _system_message(user_name: str = "") -> dict:
+    if not user_name:
+        return _SYSTEM_MESSAGE
+    return _named_system_message(user_name)
+
+
+@lru_cache(maxsize=1024)
+def _named_system_message(user_name: str) -> dict:
+    return {
+        "role": "system",
+        "content": (
+            f"{SYSTEM_PROMPT}\n\n"
+            f"The user's name is {user_name}. Use it naturally sometimes, but not every message."
+        ),
+    }
+
+
+# In-character replies for the offer_content vibes the model usually picks.
+# A known vibe is answered from here instead of a second completion call.
+_OFFER_REPLIES = {
+    "spicy": [
+        "I picked something a little daring for you — {title}. ${price} and it's yours… tap the link when you're ready 💋",
+        "You asked for spicy, so I chose {title}. Just ${price}. Don't say I didn't warn you 😏",
+    ],
+    "intimate": [
+        "This one feels personal — {title}. ${price}, and it's just between us. Tap the link whenever you want it 💭",
+        "I don't share {title} with everyone… ${price} and it's yours. The link is right there 💋",
+    ],
+    "exclusive": [
+        "Only a few people get to see {title}. ${price} — tap the link if you want to be one of them ✨",
+        "Something exclusive, just for you: {title}. ${price} and it's yours 💋",
+    ],
+    "playful": [
+        "Okay, I'll play along… {title} is ready for you. ${price} — tap the link 😉",
+        "You make it hard to say no. {title}, ${price}. The link is waiting for you 💋",
+    ],
+    "teasing": [
+        "Maybe I'll let you see {title}… ${price} and the link is all yours 😏",
+        "You're curious, aren't you? {title} — ${price}. Tap when you're ready 💭",
+    ],
+}
+
+
+async def _complete_text(**params) -> str:
+    """Run a non-streamed completion and return the stripped reply text.
+    The JSON body is read with orjson instead of being built into the
+    SDK's pydantic response models — only one field is needed."""
+    raw = await client.chat.completions.with_raw_response.create(**params)
+    return orjson.loads(raw.content)["choices"][0]["message"]["content"].strip()
+
+
+# Unambiguous requests for paid content are answered with an offer directly,
+# without asking the model to make the offer_content call
+_INTENT_RE = re.compile(
+    r"\b(?:nudes?|send (?:me )?(?:a |some )?(?:pics?|photos?)|unlock"
+    r"|show me (?:more|something)|something (?:spicy|exclusive|private))\b",
+    re.IGNORECASE,
+)
+# Negations and support/payment talk ("I can't unlock my photo", "paid but
+# no photo") go to the model instead, so they get help rather than a pitch
+_NOT_INTENT_RE = re.compile(
+    r"\b(?:not|no|never|don['’]?t|doesn['’]?t|didn['’]?t|can['’]?t|cannot|won['’]?t|wasn['’]?t|isn['’]?t|stop"
+    r"|help|support|problem|issue|error|broken|refund|charged|paid|payment|wrong|missing)\b",
+    re.IGNORECASE,
+)
+# First keyword found in the message decides the vibe
+_INTENT_VIBES = (
+    ("nude", "spicy"),
+    ("spicy", "spicy"),
+    ("private", "intimate"),
+    ("exclusive", "exclusive"),
+    ("more", "teasing"),
+)
+
+
+def _intent_vibe(text: str) -> str:
+    lowered = text.lower()
+    for word, vibe in _INTENT_VIBES:
+        if word in lowered:
+            return vibe
+    return "exclusive"
+
+
+def _offer_tool_call(call_id: str, vibe: str) -> dict:
+    """History entry for an assistant offer_content call."""
+    return {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [{
+            "id": call_id,
+            "type": "function",
+            "function": {
+                "name": "offer_content",
+                "arguments": orjson.dumps({"vibe": vibe}).decode(),
+            }
+        }]
+    }
 
 
 class ContentRequest:
@@ -110,68 +270,81 @@ class ContentRequest:
         self.ai_message = ai_message
 
 
-async def chat(user_id: int, user_message: str, user_name: str = ""):
+async def chat(user_id: int, user_message: str, user_name: str = "", on_partial=None):
     """
     Send a message to OpenAI and return:
     - str: normal text reply
     - ContentRequest: AI wants to offer paid content (caller must handle purchase flow)
+
+    The reply is streamed; if on_partial is given it is awaited with the
+    text received so far each time a new fragment arrives.
+    Call inside conversation_turn(user_id).
     """
     if not client:
         return "Chat is not available right now. Please try again later."
 
-    history = _histories[user_id]
+    history = _get_history(user_id)
     history.append({"role": "user", "content": user_message})
+    _trim_history(history)
 
-    if len(history) > MAX_HISTORY:
-        history[:] = history[-MAX_HISTORY:]
-
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-
-    if user_name:
-        messages.append({
-            "role": "system",
-            "content": f"The user's name is {user_name}. Use it naturally sometimes, but not every message."
-        })
+    # Obvious purchase intent: record the same tool call the model
+    # would have made and skip the completion
+    if _INTENT_RE.search(user_message) and not _NOT_INTENT_RE.search(user_message):
+        vibe = _intent_vibe(user_message)
+        history.append(_offer_tool_call(f"call_{uuid.uuid4().hex[:24]}", vibe))
+        return ContentRequest(vibe=vibe, ai_message="")
 
+    messages = [_system_message(user_name)]
     messages.extend(history)
 
     try:
-        response = await client.chat.completions.create(
+        stream = await client.chat.completions.create(
             model=OPENAI_MODEL,
             messages=messages,
             tools=TOOLS,
             tool_choice="auto",
             max_tokens=300,
             temperature=0.9,
+            user=str(user_id),
+            stream=True,
         )
 
-        msg = response.choices[0].message
+        # Text arrives as content fragments; a tool call as id/name
+        # first, then argument fragments. Only the first call is used.
+        content = ""
+        tool_call_id = tool_name = None
+        tool_args = []
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            for tc in delta.tool_calls or ():
+                if tc.index != 0:
+                    continue
+                if tc.id:
+                    tool_call_id = tc.id
+                if tc.function and tc.function.name:
+                    tool_name = tc.function.name
+                if tc.function and tc.function.arguments:
+                    tool_args.append(tc.function.arguments)
+            if delta.content:
+                content += delta.content
+                if on_partial:
+                    await on_partial(content)
 
         # Check if AI wants to call the offer_content function
-        if msg.tool_calls:
-            tool_call = msg.tool_calls[0]
-            if tool_call.function.name == "offer_content":
-                args = json.loads(tool_call.function.arguments)
-                vibe = args.get("vibe", "exclusive")
-
-                # Store the tool call in history so we can continue the conversation
-                history.append({
-                    "role": "assistant",
-                    "content": None,
-                    "tool_calls": [{
-                        "id": tool_call.id,
-                        "type": "function",
-                        "function": {
-                            "name": "offer_content",
-                            "arguments": tool_call.function.arguments,
-                        }
-                    }]
-                })
-
-                return ContentRequest(vibe=vibe, ai_message="")
+        if tool_name == "offer_content":
+            arguments = "".join(tool_args)
+            args = orjson.loads(arguments)
+            vibe = args.get("vibe", "exclusive")
+
+            # Store the tool call in history so we can continue the conversation
+            history.append(_offer_tool_call(tool_call_id, vibe))
+
+            return ContentRequest(vibe=vibe, ai_message="")
 
         # Normal text reply
-        reply = msg.content.strip() if msg.content else ""
+        reply = content.strip()
         history.append({"role": "assistant", "content": reply})
         return reply
 
@@ -180,32 +353,42 @@ async def chat(user_id: int, user_message: str, user_name: str = ""):
         return "I got a little distracted… send that again? 💭"
 
 
-async def get_post_offer_reply(user_id: int, tool_call_id: str, image_title: str, price: float, user_name: str = "") -> str:
-    """After we find an image to offer, get the AI's natural response about it."""
-    history = _histories[user_id]
+async def get_post_offer_reply(
+    user_id: int, tool_call_id: str, image_title: str, price: float, user_name: str = "", vibe: str = "",
+) -> str:
+    """After we find an image to offer, get the AI's natural response about it.
+    Known vibes use a canned in-character reply; others ask the model.
+    Call inside the same conversation_turn(user_id) as the chat() that made the offer."""
+    history = _get_history(user_id)
 
     # Add function result to history
     history.append({
         "role": "tool",
         "tool_call_id": tool_call_id,
-        "content": json.dumps({
+        "content": orjson.dumps({
             "image_title": image_title,
             "price": price,
             "status": "payment_link_sent",
-        })
+        }).decode()
     })
 
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    templates = _OFFER_REPLIES.get(vibe.lower())
+    if templates:
+        reply = random.choice(templates).format(title=image_title, price=f"{price:.0f}")
+        history.append({"role": "assistant", "content": reply})
+        return reply
+
+    messages = [_SYSTEM_MESSAGE]
     messages.extend(history)
 
     try:
-        response = await client.chat.completions.create(
+        reply = await _complete_text(
             model=OPENAI_MODEL,
             messages=messages,
             max_tokens=200,
             temperature=0.9,
+            user=str(user_id),
         )
-        reply = response.choices[0].message.content.strip()
         history.append({"role": "assistant", "content": reply})
         return reply
     except Exception as e:
@@ -213,6 +396,15 @@ async def get_post_offer_reply(user_id: int, tool_call_id: str, image_title: str
         return f"I picked something special for you — {image_title}. Tap the link whenever you're ready 💋"
 
 
+def withdraw_offer(user_id: int, reply: str):
+    """Nothing to offer: drop the dangling offer_content call and record the
+    reply sent instead. Call inside conversation_turn(user_id)."""
+    history = _get_history(user_id)
+    if history and history[-1].get("tool_calls"):
+        history.pop()
+    history.append({"role": "assistant", "content": reply})
+
+
 def clear_history(user_id: int):
     """Clear conversation history for a user."""
     _histories.pop(user_id, None)
@@ -220,7 +412,7 @@ def clear_history(user_id: int):
 
 def get_last_tool_call_id(user_id: int) -> str:
     """Get the tool_call_id from the last function call in history."""
-    history = _histories.get(user_id, [])
+    history = _histories.get(user_id, ())
     for msg in reversed(history):
         if msg.get("tool_calls"):
             return msg["tool_calls"][0]["id"]
@@ -240,27 +432,40 @@ Style rules:
 - No explicit content, no begging for likes/follows
 - Hashtags should be relevant and tasteful"""
 
+_CAPTION_SYSTEM_MESSAGE = {"role": "system", "content": CAPTION_SYSTEM_PROMPT}
+
+# Generated captions by (title, description); rescheduling an image with a
+# blank caption reuses the one already written instead of calling OpenAI
+_captions: LRUCache = LRUCache(maxsize=1024)
+
 
 async def generate_caption(image_title: str, image_description: str = "") -> str:
     """Generate an Instagram caption in the Jiselle persona."""
     if not client:
         return ""
 
+    key = (image_title, image_description)
+    cached = _captions.get(key)
+    if cached is not None:
+        return cached
+
     context = f"Image title: {image_title}"
     if image_description:
         context += f"\nDescription: {image_description}"
 
     try:
-        response = await client.chat.completions.create(
+        caption = await _complete_text(
             model=OPENAI_MODEL,
             messages=[
-                {"role": "system", "content": CAPTION_SYSTEM_PROMPT},
+                _CAPTION_SYSTEM_MESSAGE,
                 {"role": "user", "content": f"Write an Instagram caption for this post.\n\n{context}"},
             ],
             max_tokens=200,
             temperature=0.95,
         )
-        return response.choices[0].message.content.strip()
+        if caption:
+            _captions[key] = caption
+        return caption
     except Exception as e:
         logger.error(f"Caption generation error: {e}")
         return ""
@@ -1,6 +1,18 @@
 import httpx
+import zlib
+import time
+import asyncio
 import base64
+import certifi
+import datetime
 import logging
+from urllib.parse import urlparse
+from cachetools import LRUCache
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
 from bot.config import PAYPAL_CLIENT_ID, PAYPAL_CLIENT_SECRET, PAYPAL_MODE, BASE_URL
 
 logger = logging.getLogger(__name__)
@@ -12,23 +24,59 @@ PAYPAL_BASE = (
 )
 
 
+# One keep-alive client for every PayPal call — avoids a TLS handshake per request
+_CLIENT = httpx.AsyncClient(
+    base_url=PAYPAL_BASE,
+    timeout=15.0,
+    limits=httpx.Limits(max_keepalive_connections=20),
+)
+
+# Caps concurrent order creation below PayPal's rate limit
+_PAYPAL_SEM = asyncio.Semaphore(20)
+
+# Cached OAuth token, refreshed shortly before PayPal expires it
+TOKEN_REFRESH_MARGIN = 60
+_token: str = None
+_token_expires_at: float = 0.0
+_TOKEN_LOCK = asyncio.Lock()
+
+
 async def _get_access_token() -> str:
-    """Get PayPal OAuth2 access token."""
+    """Get PayPal OAuth2 access token, reusing the cached one while valid."""
+    if _token and time.monotonic() < _token_expires_at:
+        return _token
+    # One refresh at a time — concurrent callers wait for it instead of
+    # each requesting their own token
+    async with _TOKEN_LOCK:
+        if _token and time.monotonic() < _token_expires_at:
+            return _token
+        return await _refresh_access_token()
+
+
+async def _refresh_access_token() -> str:
+    global _token, _token_expires_at
     credentials = base64.b64encode(
         f"{PAYPAL_CLIENT_ID}:{PAYPAL_CLIENT_SECRET}".encode()
     ).decode()
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{PAYPAL_BASE}/v1/oauth2/token",
-            headers={
-                "Authorization": f"Basic {credentials}",
-                "Content-Type": "application/x-www-form-urlencoded",
-            },
-            data={"grant_type": "client_credentials"},
-        )
-        response.raise_for_status()
-        return response.json()["access_token"]
+    response = await _CLIENT.post(
+        "/v1/oauth2/token",
+        headers={
+            "Authorization": f"Basic {credentials}",
+            "Content-Type": "application/x-www-form-urlencoded",
+        },
+        data={"grant_type": "client_credentials"},
+    )
+    response.raise_for_status()
+    data = response.json()
+    _token = data["access_token"]
+    _token_expires_at = time.monotonic() + data.get("expires_in", 0) - TOKEN_REFRESH_MARGIN
+    return _token
+
+
+async def close():
+    """Close the shared HTTP client. Called on app shutdown."""
+    await _CLIENT.aclose()
 
 
 async def create_order(
@@ -41,6 +89,11 @@ async def create_order(
     Create a PayPal checkout order.
     Returns: {"order_id": str, "approve_url": str}
     """
+    async with _PAYPAL_SEM:
+        return await _create_order(amount, currency, description, custom_id)
+
+
+async def _create_order(amount: float, currency: str, description: str, custom_id: str) -> dict:
     token = await _get_access_token()
 
     order_data = {
@@ -64,17 +117,16 @@ async def create_order(
         },
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{PAYPAL_BASE}/v2/checkout/orders",
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-            },
-            json=order_data,
-        )
-        response.raise_for_status()
-        data = response.json()
+    response = await _CLIENT.post(
+        "/v2/checkout/orders",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        },
+        json=order_data,
+    )
+    response.raise_for_status()
+    data = response.json()
 
     approve_url = None
     for link in data.get("links", []):
@@ -92,37 +144,146 @@ async def capture_order(paypal_order_id: str) -> dict:
     """Capture a PayPal order after user approval."""
     token = await _get_access_token()
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{PAYPAL_BASE}/v2/checkout/orders/{paypal_order_id}/capture",
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-            },
-        )
-        response.raise_for_status()
-        return response.json()
+    response = await _CLIENT.post(
+        f"/v2/checkout/orders/{paypal_order_id}/capture",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        },
+    )
+    response.raise_for_status()
+    return response.json()
 
 
 async def get_order_details(paypal_order_id: str) -> dict:
     """Get details of a PayPal order."""
     token = await _get_access_token()
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{PAYPAL_BASE}/v2/checkout/orders/{paypal_order_id}",
-            headers={
-                "Authorization": f"Bearer {token}",
-            },
-        )
+    response = await _CLIENT.get(
+        f"/v2/checkout/orders/{paypal_order_id}",
+        headers={
+            "Authorization": f"Bearer {token}",
+        },
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+# Webhook signing certs by URL — PayPal publishes a new URL when it rotates them.
+# Values are (leaf cert, time the chain stops being valid or None if untrusted).
+_webhook_certs: LRUCache = LRUCache(maxsize=8)
+# certifi's CA bundle by subject, loaded on first use
+_trusted_roots: dict = {}
+
+
+def _is_paypal_host(host: str) -> bool:
+    return host == "paypal.com" or host.endswith(".paypal.com")
+
+
+def _is_paypal_cert_url(url: str) -> bool:
+    parsed = urlparse(url)
+    return parsed.scheme == "https" and _is_paypal_host(parsed.hostname or "")
+
+
+def _roots_for(issuer: x509.Name) -> list:
+    if not _trusted_roots:
+        with open(certifi.where(), "rb") as f:
+            for root in x509.load_pem_x509_certificates(f.read()):
+                _trusted_roots.setdefault(root.subject, []).append(root)
+    return _trusted_roots.get(issuer, [])
+
+
+def _issued_by(cert: x509.Certificate, root: x509.Certificate) -> bool:
+    try:
+        cert.verify_directly_issued_by(root)
+    except (InvalidSignature, ValueError, TypeError):
+        return False
+    return True
+
+
+def _trusted_until(chain: list) -> datetime.datetime | None:
+    """Validate a PEM chain (leaf first) up to a CA in certifi's bundle:
+    every cert in its validity window, each signed by the next, issuers
+    marked as CAs, and the leaf issued to a paypal.com name.
+    Returns when the chain expires, or None if it isn't trusted."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    leaf = chain[0]
+    names = leaf.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+    if not names or not _is_paypal_host(str(names[0].value).lower()):
+        return None
+
+    try:
+        for cert, issuer in zip(chain, chain[1:]):
+            if not issuer.extensions.get_extension_for_class(x509.BasicConstraints).value.ca:
+                return None
+            cert.verify_directly_issued_by(issuer)
+        top = chain[-1]
+        anchors = [root for root in _roots_for(top.issuer) if _issued_by(top, root)]
+    except (x509.ExtensionNotFound, InvalidSignature, ValueError, TypeError):
+        return None
+    if not anchors:
+        return None
+
+    certs = chain + anchors[:1]
+    if any(not (c.not_valid_before_utc <= now <= c.not_valid_after_utc) for c in certs):
+        return None
+    return min(c.not_valid_after_utc for c in certs)
+
+
+async def _get_webhook_cert(url: str) -> x509.Certificate:
+    """The leaf signing cert behind a PayPal cert URL. Raises ValueError if
+    its chain doesn't validate, so the caller falls back to PayPal's API."""
+    entry = _webhook_certs.get(url)
+    if entry is None:
+        response = await _CLIENT.get(url)
         response.raise_for_status()
-        return response.json()
+        chain = x509.load_pem_x509_certificates(response.content)
+        entry = _webhook_certs[url] = (chain[0], _trusted_until(chain))
+    cert, valid_until = entry
+    if valid_until is None or datetime.datetime.now(datetime.timezone.utc) > valid_until:
+        raise ValueError(f"PayPal signing cert chain not trusted or expired: {url}")
+    return cert
+
+
+async def _verify_webhook_locally(headers: dict, body: bytes, webhook_id: str) -> bool:
+    """Check the RSA-SHA256 signature PayPal puts on the transmission
+    against its signing cert. Raises if the cert can't be fetched."""
+    cert_url = headers.get("paypal-cert-url", "")
+    if not _is_paypal_cert_url(cert_url):
+        logger.warning(f"PayPal webhook cert URL not on paypal.com: {cert_url!r}")
+        return False
+
+    cert = await _get_webhook_cert(cert_url)
+    message = (
+        f"{headers.get('paypal-transmission-id', '')}|"
+        f"{headers.get('paypal-transmission-time', '')}|"
+        f"{webhook_id}|{zlib.crc32(body)}"
+    ).encode()
+    try:
+        cert.public_key().verify(
+            base64.b64decode(headers.get("paypal-transmission-sig", "")),
+            message,
+            padding.PKCS1v15(),
+            hashes.SHA256(),
+        )
+    except (InvalidSignature, ValueError):
+        return False
+    return True
 
 
 async def verify_webhook_signature(
-    headers: dict, body: bytes, webhook_id: str
+    headers: dict, event: dict, webhook_id: str, body: bytes = None
 ) -> bool:
-    """Verify PayPal webhook signature."""
+    """Verify PayPal webhook signature. `event` is the already-parsed body.
+    With the raw `body` the signature is checked locally; PayPal's verify
+    API is only called without it or when the signing cert can't be loaded
+    or its chain doesn't validate against certifi's CA bundle."""
+    if body is not None and headers.get("paypal-auth-algo") == "SHA256withRSA":
+        try:
+            return await _verify_webhook_locally(headers, body, webhook_id)
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning(f"PayPal cert not usable locally, verifying via API: {e}")
+
     token = await _get_access_token()
 
     verification_data = {
@@ -132,18 +293,17 @@ async def verify_webhook_signature(
         "transmission_sig": headers.get("paypal-transmission-sig", ""),
         "transmission_time": headers.get("paypal-transmission-time", ""),
         "webhook_id": webhook_id,
-        "webhook_event": __import__("json").loads(body),
+        "webhook_event": event,
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{PAYPAL_BASE}/v1/notifications/verify-webhook-signature",
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-            },
-            json=verification_data,
-        )
-        response.raise_for_status()
-        result = response.json()
-        return result.get("verification_status") == "SUCCESS"
+    response = await _CLIENT.post(
+        "/v1/notifications/verify-webhook-signature",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        },
+        json=verification_data,
+    )
+    response.raise_for_status()
+    result = response.json()
+    return result.get("verification_status") == "SUCCESS"
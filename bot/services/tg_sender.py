@@ -0,0 +1,187 @@
+"""
+Rate-limited outbound Telegram message queue.
+
+Notifications and broadcasts are enqueued here instead of calling
+bot.send_message / send_photo / copy_message directly. A single dispatcher drains the queue under a
+30 msg/s global token bucket, one message at a time and at most one per
+PER_CHAT_INTERVAL per chat, and adapts its concurrency AIMD-style: halved
+(and paused) on a 429 RetryAfter, nudged back up after a run of
+successful sends. On shutdown the queue is flushed for up to
+STOP_FLUSH_SECONDS.
+"""
+
+import time
+import asyncio
+import logging
+import datetime
+from cachetools import LRUCache
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE_PER_SEC = 30
+MAX_CONCURRENCY = 8.0
+MIN_CONCURRENCY = 1.0
+INCREASE_EVERY = 50  # successful sends per +0.5 concurrency
+PER_CHAT_INTERVAL = 1.0  # seconds between sends to the same chat
+STOP_FLUSH_SECONDS = 10
+
+_bot = None
+_queue: asyncio.Queue = None
+_dispatcher: asyncio.Task = None
+_slots: asyncio.Condition = None
+
+_concurrency = MAX_CONCURRENCY
+_in_flight = 0
+_success_streak = 0
+_resume_at = 0.0  # monotonic time until which all sends are paused
+_tokens = float(GLOBAL_RATE_PER_SEC)
+_last_refill = 0.0
+_chat_locks: LRUCache = LRUCache(maxsize=10_000)
+_chat_next_send: LRUCache = LRUCache(maxsize=10_000)  # chat_id → monotonic time
+# Strong references to running deliveries; the loop only keeps weak ones
+_tasks: set = set()
+
+
+def start(bot):
+    """Start the dispatcher. Called once from the app lifespan."""
+    global _bot, _queue, _dispatcher, _slots, _last_refill
+    _bot = bot
+    _queue = asyncio.Queue()
+    _slots = asyncio.Condition()
+    _last_refill = time.monotonic()
+    _dispatcher = asyncio.create_task(_dispatch())
+
+
+async def stop(timeout: float = STOP_FLUSH_SECONDS):
+    """Send what is still queued, for up to `timeout` seconds, then stop the
+    dispatcher. Payment and VIP notices go through here, so they're flushed
+    rather than dropped; anything left after the timeout is logged."""
+    if not _dispatcher:
+        return
+    try:
+        await asyncio.wait_for(_queue.join(), timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"Telegram sender stopped with {_queue.qsize()} messages unsent")
+    _dispatcher.cancel()
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(_dispatcher, *_tasks, return_exceptions=True)
+
+
+async def enqueue_send(chat_id: int, text: str, **kwargs):
+    """Queue a send_message call. Returns immediately."""
+    await _queue.put(("send_message", chat_id, {"text": text, **kwargs}))
+
+
+async def enqueue_send_photo(chat_id: int, photo, **kwargs):
+    """Queue a send_photo call. Returns immediately."""
+    await _queue.put(("send_photo", chat_id, {"photo": photo, **kwargs}))
+
+
+async def enqueue_copy(chat_id: int, from_chat_id: int, message_id: int, **kwargs):
+    """Queue a copy_message call. Returns immediately."""
+    await _queue.put((
+        "copy_message", chat_id,
+        {"from_chat_id": from_chat_id, "message_id": message_id, **kwargs},
+    ))
+
+
+def _retry_seconds(exc: RetryAfter) -> float:
+    retry = exc.retry_after
+    if isinstance(retry, datetime.timedelta):
+        return retry.total_seconds()
+    return float(retry)
+
+
+async def _take_token():
+    """Block until the global token bucket allows one more send."""
+    global _tokens, _last_refill
+    while True:
+        now = time.monotonic()
+        _tokens = min(GLOBAL_RATE_PER_SEC, _tokens + (now - _last_refill) * GLOBAL_RATE_PER_SEC)
+        _last_refill = now
+        if _tokens >= 1:
+            _tokens -= 1
+            return
+        await asyncio.sleep((1 - _tokens) / GLOBAL_RATE_PER_SEC)
+
+
+def _reserve_chat(chat_id: int) -> float:
+    """Book the chat's next send time. Returns the seconds until it."""
+    now = time.monotonic()
+    at = max(now, _chat_next_send.get(chat_id, 0.0))
+    _chat_next_send[chat_id] = at + PER_CHAT_INTERVAL
+    return at - now
+
+
+async def _acquire_slot():
+    global _in_flight
+    async with _slots:
+        await _slots.wait_for(lambda: _in_flight < int(_concurrency))
+        _in_flight += 1
+
+
+async def _dispatch():
+    while True:
+        item = await _queue.get()
+        delay = _reserve_chat(item[1])
+        if delay > 0:
+            # Throttled chat: wait off to the side, without holding a slot
+            # or a token, so other chats keep flowing
+            _spawn(_deliver_later(delay, item))
+            continue
+        await _acquire_slot()
+        await _take_token()
+        _spawn(_deliver(item))
+
+
+async def _deliver_later(delay: float, item):
+    await asyncio.sleep(delay)
+    await _acquire_slot()
+    await _take_token()
+    await _deliver(item)
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _deliver(item):
+    global _in_flight, _concurrency, _success_streak, _resume_at
+    method, chat_id, kwargs = item
+    lock = _chat_locks.get(chat_id)
+    if lock is None:
+        lock = _chat_locks[chat_id] = asyncio.Lock()
+
+    try:
+        async with lock:
+            pause = _resume_at - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            try:
+                await getattr(_bot, method)(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                wait = _retry_seconds(e)
+                _resume_at = max(_resume_at, time.monotonic() + wait)
+                _concurrency = max(MIN_CONCURRENCY, _concurrency * 0.5)
+                _success_streak = 0
+                logger.warning(f"Telegram 429, pausing {wait:.0f}s (concurrency → {_concurrency:.1f})")
+                _queue.put_nowait(item)
+                return
+            except Exception as e:
+                logger.warning(f"Failed to send message to {chat_id}: {e}")
+                return
+
+            _success_streak += 1
+            if _success_streak >= INCREASE_EVERY:
+                _success_streak = 0
+                _concurrency = min(MAX_CONCURRENCY, _concurrency + 0.5)
+    finally:
+        async with _slots:
+            _in_flight -= 1
+            _slots.notify_all()
+        # A 429 re-queued the item above, so join() still waits for it
+        _queue.task_done()
@@ -0,0 +1,124 @@
+"""
+In-process cache of Telegram users for the menu handlers.
+
+Every button press used to SELECT the user row and UPDATE last_active.
+Snapshots are now kept for a minute keyed by telegram_id, and last_active
+writes are collected here and flushed in a single UPDATE by the scheduler.
+Anything that changes a cached field must call invalidate().
+"""
+
+import asyncio
+import logging
+import datetime
+import threading
+from dataclasses import dataclass
+from cachetools import TTLCache
+from sqlalchemy import case, update
+from bot.models.database import SessionLocal, lift_statement_timeout
+from bot.models.schemas import User
+from bot.services.clock import utcnow_1s
+
+logger = logging.getLogger(__name__)
+
+USER_TTL_SECONDS = 60
+LAST_ACTIVE_THROTTLE_SECONDS = 60
+
+_users: TTLCache = TTLCache(maxsize=10_000, ttl=USER_TTL_SECONDS)
+# users.id → telegram_id; the mapping never changes, so nothing invalidates it
+_telegram_ids: TTLCache = TTLCache(maxsize=1024, ttl=USER_TTL_SECONDS)
+_last_active: dict[int, datetime.datetime] = {}
+# Users whose activity was recorded recently; touch() ignores them until expiry
+_recently_touched: TTLCache = TTLCache(maxsize=10_000, ttl=LAST_ACTIVE_THROTTLE_SECONDS)
+# cachetools caches aren't thread-safe and the payment/scheduler paths use
+# them from asyncio.to_thread workers; every access to the three goes under this
+_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Read-only snapshot of the User columns the menu handlers need."""
+    id: int
+    telegram_id: int
+    username: str | None
+    first_name: str | None
+    vip_tier: str
+    free_unlocks: int
+
+
+def get(telegram_id: int) -> CachedUser | None:
+    """Return the cached snapshot for a user, or None on a miss."""
+    with _lock:
+        return _users.get(telegram_id)
+
+
+def put(user: User) -> CachedUser:
+    """Snapshot a freshly loaded User row into the cache."""
+    cached = CachedUser(
+        id=user.id,
+        telegram_id=user.telegram_id,
+        username=user.username,
+        first_name=user.first_name,
+        vip_tier=user.vip_tier,
+        free_unlocks=user.free_unlocks or 0,
+    )
+    with _lock:
+        _users[user.telegram_id] = cached
+    return cached
+
+
+def telegram_id_for(db, user_id: int) -> int | None:
+    """Resolve a users.id to its telegram_id, reading only that column on a miss."""
+    with _lock:
+        telegram_id = _telegram_ids.get(user_id)
+    if telegram_id is None:
+        telegram_id = db.query(User.telegram_id).filter(User.id == user_id).scalar()
+        if telegram_id is not None:
+            with _lock:
+                _telegram_ids[user_id] = telegram_id
+    return telegram_id
+
+
+def invalidate(telegram_id: int) -> None:
+    """Drop a user's snapshot after their row was modified."""
+    with _lock:
+        _users.pop(telegram_id, None)
+
+
+def touch(telegram_id: int) -> None:
+    """Record activity; the write happens on the next flush.
+    At most one stamp per user per LAST_ACTIVE_THROTTLE_SECONDS."""
+    with _lock:
+        if telegram_id in _recently_touched:
+            return
+        _recently_touched[telegram_id] = True
+    _last_active[telegram_id] = utcnow_1s()
+
+
+def _write_last_active(pending: dict[int, datetime.datetime]):
+    """One UPDATE giving each user their own timestamp. Runs in a worker thread."""
+    with SessionLocal() as db:
+        lift_statement_timeout(db)
+        db.execute(
+            update(User)
+            .where(User.telegram_id.in_(list(pending)))
+            .values(last_active=case(pending, value=User.telegram_id))
+        )
+        db.commit()
+
+
+async def flush_last_active():
+    """Write pending last_active timestamps in one UPDATE.
+    Called periodically by the scheduler. On failure the batch is kept
+    for the next flush."""
+    global _last_active
+    if not _last_active:
+        return
+
+    pending, _last_active = _last_active, {}
+    try:
+        await asyncio.to_thread(_write_last_active, pending)
+    except Exception as e:
+        logger.error(f"last_active flush failed: {e}")
+        # Stamps recorded since the swap are newer; keep those
+        for telegram_id, ts in pending.items():
+            _last_active.setdefault(telegram_id, ts)
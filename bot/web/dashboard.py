@@ -3,6 +3,7 @@ Web dashboard for managing images and scheduling Instagram posts.
 Protected by simple password auth via cookie session.
 """
 
+import asyncio
 import logging
 import datetime
 import mimetypes
@@ -11,10 +12,14 @@ from typing import List
 from fastapi import APIRouter, Request, Form, UploadFile, File, Depends, HTTPException
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response
 from fastapi.templating import Jinja2Templates
-
-from bot.config import ADMIN_PASSWORD, INSTAGRAM_USER_ID, INSTAGRAM_ACCESS_TOKEN
-from bot.services.nudity_check import classify_image
-from bot.models.database import SessionLocal
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+from cachetools import TTLCache
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session, joinedload
+
+from bot.config import ADMIN_PASSWORD, INSTAGRAM_USER_ID, INSTAGRAM_ACCESS_TOKEN, TEMPLATE_AUTO_RELOAD
+from bot.services.nudity_check import classify_images_bulk
+from bot.models.database import SessionLocal, get_db
 from bot.models.schemas import (
     Image, Category, ContentType, ScheduledPost, User, Order, OrderStatus,
 )
@@ -25,7 +30,22 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/dashboard")
 
 TEMPLATE_DIR = Path(__file__).parent / "templates"
-templates = Jinja2Templates(directory=str(TEMPLATE_DIR))
+# Compiled templates are kept in a per-user temp-dir bytecode cache, so a
+# restarted process skips re-compiling them; in production templates only
+# change on deploy, so the per-render source mtime check is off too
+templates = Jinja2Templates(env=Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=True,
+    auto_reload=TEMPLATE_AUTO_RELOAD,
+    bytecode_cache=FileSystemBytecodeCache(),
+))
+
+
+def preload_templates():
+    """Compile every dashboard template up front so the first request to
+    each page doesn't pay for it. Called once from the app lifespan."""
+    for name in templates.env.list_templates():
+        templates.env.get_template(name)
 
 
 # ── Auth helpers ──────────────────────────────────────
@@ -70,70 +90,119 @@ async def logout(request: Request):
 
 # ── Dashboard home ────────────────────────────────────
 
-@router.get("", response_class=HTMLResponse)
-async def dashboard_home(request: Request, _=Depends(require_login)):
-    db = SessionLocal()
-    try:
-        total_images = db.query(Image).filter(Image.is_active == True).count()
-        ig_images = db.query(Image).filter(
-            Image.content_type == ContentType.INSTAGRAM.value, Image.is_active == True
-        ).count()
-        private_images = total_images - ig_images
-        total_users = db.query(User).count()
-        total_orders = db.query(Order).filter(Order.status == OrderStatus.COMPLETED.value).count()
-        pending_posts = db.query(ScheduledPost).filter(ScheduledPost.status == "pending").count()
-        recent_posts = (
-            db.query(ScheduledPost)
-            .order_by(ScheduledPost.created_at.desc())
-            .limit(5)
-            .all()
+# Home counters change slowly; dashboard writes clear them right away,
+# bot-side changes (users, orders) show up within the TTL
+DASHBOARD_COUNTS_TTL_SECONDS = 30
+_counts: TTLCache = TTLCache(maxsize=1, ttl=DASHBOARD_COUNTS_TTL_SECONDS)
+
+
+def invalidate_dashboard_counts():
+    _counts.clear()
+
+
+def _dashboard_counts(db) -> tuple:
+    """(total_images, ig_images, total_users, total_orders, pending_posts)"""
+    counts = _counts.get("home")
+    if counts is not None:
+        return counts
+
+    # All counters in one round-trip: conditional aggregates over images,
+    # scalar subqueries for the other tables
+    image_counts = (
+        select(
+            func.count().label("total"),
+            func.count().filter(
+                Image.content_type == ContentType.INSTAGRAM.value
+            ).label("instagram"),
         )
+        .where(Image.is_active == True)
+        .subquery()
+    )
+    counts = _counts["home"] = tuple(db.query(
+        image_counts.c.total,
+        image_counts.c.instagram,
+        select(func.count(User.id)).scalar_subquery(),
+        select(func.count(Order.id))
+        .where(Order.status == OrderStatus.COMPLETED.value)
+        .scalar_subquery(),
+        select(func.count(ScheduledPost.id))
+        .where(ScheduledPost.status == "pending")
+        .scalar_subquery(),
+    ).one())
+    return counts
 
-        return templates.TemplateResponse("dashboard.html", {
-            "request": request,
-            "total_images": total_images,
-            "ig_images": ig_images,
-            "private_images": private_images,
-            "total_users": total_users,
-            "total_orders": total_orders,
-            "pending_posts": pending_posts,
-            "recent_posts": recent_posts,
-        })
-    finally:
-        db.close()
+
+@router.get("", response_class=HTMLResponse)
+async def dashboard_home(request: Request, _=Depends(require_login), db: Session = Depends(get_db)):
+    total_images, ig_images, total_users, total_orders, pending_posts = _dashboard_counts(db)
+    private_images = total_images - ig_images
+    recent_posts = (
+        db.query(ScheduledPost)
+        .options(joinedload(ScheduledPost.image))
+        .order_by(ScheduledPost.created_at.desc())
+        .limit(5)
+        .all()
+    )
+
+    return templates.TemplateResponse("dashboard.html", {
+        "request": request,
+        "total_images": total_images,
+        "ig_images": ig_images,
+        "private_images": private_images,
+        "total_users": total_users,
+        "total_orders": total_orders,
+        "pending_posts": pending_posts,
+        "recent_posts": recent_posts,
+    })
 
 
 # ── Images gallery ────────────────────────────────────
 
+IMAGES_PER_PAGE = 48
+
+
 @router.get("/images", response_class=HTMLResponse)
-async def images_page(request: Request, content_type: str = "all", _=Depends(require_login)):
-    db = SessionLocal()
-    try:
-        q = db.query(Image).filter(Image.is_active == True)
-        if content_type == "instagram":
-            q = q.filter(Image.content_type == ContentType.INSTAGRAM.value)
-        elif content_type == "private":
-            q = q.filter(Image.content_type == ContentType.PRIVATE.value)
-
-        images = q.order_by(Image.created_at.desc()).all()
-        categories = db.query(Category).filter(Category.is_active == True).all()
-
-        return templates.TemplateResponse("images.html", {
-            "request": request,
-            "images": images,
-            "categories": categories,
-            "current_filter": content_type,
-        })
-    finally:
-        db.close()
+async def images_page(
+    request: Request,
+    content_type: str = "all",
+    page: int = 1,
+    _=Depends(require_login),
+    db: Session = Depends(get_db),
+):
+    # Only the columns the gallery cards show — rows, not ORM objects
+    q = db.query(
+        Image.id, Image.title, Image.content_type, Image.is_explicit,
+        Image.price, Image.tier, Image.total_sales,
+    ).filter(Image.is_active == True)
+    if content_type == "instagram":
+        q = q.filter(Image.content_type == ContentType.INSTAGRAM.value)
+    elif content_type == "private":
+        q = q.filter(Image.content_type == ContentType.PRIVATE.value)
+
+    # One extra row tells whether an older page exists, without a COUNT
+    page = max(page, 1)
+    images = (
+        q.order_by(Image.created_at.desc(), Image.id.desc())
+        .offset((page - 1) * IMAGES_PER_PAGE)
+        .limit(IMAGES_PER_PAGE + 1)
+        .all()
+    )
+    has_next = len(images) > IMAGES_PER_PAGE
+
+    return templates.TemplateResponse("images.html", {
+        "request": request,
+        "images": images[:IMAGES_PER_PAGE],
+        "current_filter": content_type,
+        "page": page,
+        "has_next": has_next,
+    })
 
 
 # ── Upload ────────────────────────────────────────────
 
 def _ensure_default_categories(db):
     """Create default categories if none exist."""
-    existing = db.query(Category).count()
-    if existing == 0:
+    if db.query(Category.id).first() is None:
         defaults = [
             Category(name="Instagram Posts", emoji="📸", sort_order=1, description="SFW content for Instagram"),
             Category(name="Exclusive Private", emoji="🔒", sort_order=2, description="Premium private content"),
@@ -143,21 +212,72 @@ def _ensure_default_categories(db):
         for cat in defaults:
             db.add(cat)
         db.commit()
+        invalidate_category_lookup()
         logger.info("Created default categories")
 
 
-@router.get("/upload", response_class=HTMLResponse)
-async def upload_page(request: Request, _=Depends(require_login)):
-    db = SessionLocal()
-    try:
+# Category data for the upload form and auto-sorting; categories are only
+# added by the admin bot and _ensure_default_categories, which both
+# invalidate this
+CATEGORY_LOOKUP_TTL_SECONDS = 300
+_category_lookups: TTLCache = TTLCache(maxsize=2, ttl=CATEGORY_LOOKUP_TTL_SECONDS)
+
+
+def invalidate_category_lookup():
+    _category_lookups.clear()
+
+
+def _category_lookup(db) -> tuple:
+    """Return (cat_map, fallback_cat_id, cat_names): classifier key →
+    active category id, the id used when a key has no category, and
+    id → name for every category. Ids only, so nothing session-bound is
+    kept between requests."""
+    lookup = _category_lookups.get("upload")
+    if lookup is not None:
+        return lookup
+
+    cat_map, cat_names, first_active = {}, {}, None
+    for cat_id, name, is_active in db.query(Category.id, Category.name, Category.is_active):
+        cat_names[cat_id] = name
+        if not is_active:
+            continue
+        first_active = first_active or cat_id
+        name_lower = name.lower()
+        if "lingerie" in name_lower:
+            cat_map["lingerie"] = cat_id
+        elif "lifestyle" in name_lower:
+            cat_map["lifestyle"] = cat_id
+        elif "instagram" in name_lower:
+            cat_map["instagram"] = cat_id
+        elif "exclusive" in name_lower or "private" in name_lower:
+            cat_map["exclusive"] = cat_id
+    fallback_cat_id = cat_map.get("exclusive") or first_active
+
+    lookup = _category_lookups["upload"] = (cat_map, fallback_cat_id, cat_names)
+    return lookup
+
+
+def _upload_categories(db) -> tuple:
+    """Active categories for the upload form as (id, name, emoji) rows,
+    in sort order. Creates the defaults first if there are none."""
+    categories = _category_lookups.get("form")
+    if categories is None:
         _ensure_default_categories(db)
-        categories = db.query(Category).filter(Category.is_active == True).order_by(Category.sort_order).all()
-        return templates.TemplateResponse("upload.html", {
-            "request": request,
-            "categories": categories,
-        })
-    finally:
-        db.close()
+        categories = _category_lookups["form"] = tuple(
+            db.query(Category.id, Category.name, Category.emoji)
+            .filter(Category.is_active == True)
+            .order_by(Category.sort_order)
+        )
+    return categories
+
+
+@router.get("/upload", response_class=HTMLResponse)
+async def upload_page(request: Request, _=Depends(require_login), db: Session = Depends(get_db)):
+    categories = _upload_categories(db)
+    return templates.TemplateResponse("upload.html", {
+        "request": request,
+        "categories": categories,
+    })
 
 
 @router.post("/upload")
@@ -170,142 +290,152 @@ async def upload_submit(
     image_files: List[UploadFile] = File(...),
     is_explicit: str = Form(None),
     _=Depends(require_login),
+    db: Session = Depends(get_db),
 ):
-    db = SessionLocal()
     uploaded = 0
     errors = []
 
-    try:
-        # Build category lookup: key -> Category object
-        all_cats = db.query(Category).filter(Category.is_active == True).all()
-        cat_map = {}
-        for c in all_cats:
-            name_lower = c.name.lower()
-            if "lingerie" in name_lower:
-                cat_map["lingerie"] = c
-            elif "lifestyle" in name_lower:
-                cat_map["lifestyle"] = c
-            elif "instagram" in name_lower:
-                cat_map["instagram"] = c
-            elif "exclusive" in name_lower or "private" in name_lower:
-                cat_map["exclusive"] = c
-        # Fallback category
-        fallback_cat = cat_map.get("exclusive") or (all_cats[0] if all_cats else None)
-
-        # Auto-assign category for Instagram uploads
-        if content_type == "instagram":
-            ig_cat = cat_map.get("instagram")
-            if ig_cat:
-                category_id = ig_cat.id
-
-        # Per-category counters for sequential titles
-        cat_counts = {}
-
-        for idx, image_file in enumerate(image_files):
-            file_bytes = await image_file.read()
-            if not file_bytes:
-                continue
-
-            filename = image_file.filename or "upload"
-            mimetype = image_file.content_type or mimetypes.guess_type(filename)[0] or "image/jpeg"
-
-            # AI classification: nudity + apparel/category detection
-            if is_explicit == "true":
-                flagged = True
-                auto_cat_id = category_id
+    cat_map, fallback_cat_id, cat_names = _category_lookup(db)
+
+    # Auto-assign category for Instagram uploads
+    if content_type == "instagram":
+        category_id = cat_map.get("instagram") or category_id
+
+    # Per-category counters for sequential titles, seeded up front
+    # instead of queried per category inside the loop
+    existing_counts = dict(
+        db.query(Image.category_id, func.count(Image.id))
+        .group_by(Image.category_id)
+        .all()
+    )
+    cat_counts = {}
+    rows = []
+
+    # Spooled uploads past the memory threshold are read in worker
+    # threads, so all files are read concurrently
+    contents = await asyncio.gather(*(f.read() for f in image_files))
+    files = []
+    for image_file, file_bytes in zip(image_files, contents):
+        if not file_bytes:
+            continue
+
+        filename = image_file.filename or "upload"
+        mimetype = image_file.content_type or mimetypes.guess_type(filename)[0] or "image/jpeg"
+        files.append((file_bytes, mimetype))
+
+    # AI classification: nudity + apparel/category detection, all files at once
+    if is_explicit == "true":
+        classifications = [None] * len(files)
+    else:
+        classifications = await classify_images_bulk(files)
+
+    for (file_bytes, mimetype), result in zip(files, classifications):
+        if result is None:
+            flagged = True
+            auto_cat_id = category_id
+        else:
+            flagged = result.is_explicit
+            # Use AI-detected category if user didn't manually pick one,
+            # or if content_type is private (auto-sort into subcategories)
+            if content_type == "private":
+                # Never put private uploads into Instagram category
+                cat_key = result.category_key
+                if cat_key == "instagram":
+                    cat_key = "lifestyle"  # SFW private → lifestyle
+                auto_cat_id = cat_map.get(cat_key, fallback_cat_id) or category_id
             else:
-                result = await classify_image(file_bytes, mimetype)
-                flagged = result.is_explicit
-                # Use AI-detected category if user didn't manually pick one,
-                # or if content_type is private (auto-sort into subcategories)
-                if content_type == "private":
-                    # Never put private uploads into Instagram category
-                    cat_key = result.category_key
-                    if cat_key == "instagram":
-                        cat_key = "lifestyle"  # SFW private → lifestyle
-                    detected_cat = cat_map.get(cat_key, fallback_cat)
-                    auto_cat_id = detected_cat.id if detected_cat else category_id
-                else:
-                    auto_cat_id = category_id
-
-            # Get category name for title
-            final_cat_id = auto_cat_id or category_id
-            if final_cat_id not in cat_counts:
-                cat_obj = db.query(Category).get(final_cat_id) if final_cat_id else None
-                cat_name = cat_obj.name if cat_obj else "Photo"
-                existing = db.query(Image).filter(Image.category_id == final_cat_id).count() if final_cat_id else 0
-                cat_counts[final_cat_id] = {"name": cat_name, "count": existing}
-
-            cat_counts[final_cat_id]["count"] += 1
-            title = f"{cat_counts[final_cat_id]['name']} #{cat_counts[final_cat_id]['count']}"
-
-            image = Image(
-                title=title,
-                description="",
-                category_id=final_cat_id,
-                tier=tier,
-                price=price,
-                file_data=file_bytes,
-                file_mimetype=mimetype,
-                content_type=content_type,
-                is_explicit=flagged,
-            )
-            db.add(image)
-            uploaded += 1
+                auto_cat_id = category_id
 
-        db.commit()
-        logger.info(f"Uploaded {uploaded} images ({len(errors)} failed)")
-        return RedirectResponse("/dashboard/images", status_code=303)
-    finally:
-        db.close()
+        # Get category name for title
+        final_cat_id = auto_cat_id or category_id
+        if final_cat_id not in cat_counts:
+            cat_name = cat_names.get(final_cat_id) or "Photo"
+            existing = existing_counts.get(final_cat_id, 0) if final_cat_id else 0
+            cat_counts[final_cat_id] = {"name": cat_name, "count": existing}
+
+        cat_counts[final_cat_id]["count"] += 1
+        title = f"{cat_counts[final_cat_id]['name']} #{cat_counts[final_cat_id]['count']}"
+
+        rows.append({
+            "title": title,
+            "description": "",
+            "category_id": final_cat_id,
+            "tier": tier,
+            "price": price,
+            "file_data": file_bytes,
+            "file_mimetype": mimetype,
+            "content_type": content_type,
+            "is_explicit": flagged,
+        })
+
+    # ORM bulk INSERT: one multi-row statement, no Image objects or
+    # unit-of-work bookkeeping for rows nothing reads back
+    if rows:
+        db.execute(insert(Image), rows)
+    uploaded = len(rows)
+    db.commit()
+    invalidate_dashboard_counts()
+    logger.info(f"Uploaded {uploaded} images ({len(errors)} failed)")
+    return RedirectResponse("/dashboard/images", status_code=303)
 
 
 @router.get("/images/{image_id}/file")
-async def serve_image(image_id: int):
-    """Serve an image file from the database."""
-    db = SessionLocal()
-    try:
-        image = db.query(Image).filter(Image.id == image_id).first()
-        if not image or not image.file_data:
-            raise HTTPException(status_code=404, detail="Image not found")
-        return Response(
-            content=image.file_data,
-            media_type=image.file_mimetype or "image/jpeg",
-            headers={"Cache-Control": "public, max-age=86400"},
+async def serve_image(image_id: int, request: Request, db: Session = Depends(get_db)):
+    """Serve an image file from the database.
+    Stored bytes never change for an id, so a revalidation carrying the
+    ETag is answered with a 304 without reading the blob."""
+    headers = {"Cache-Control": "public, max-age=86400", "ETag": f'"img-{image_id}"'}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        stored = (
+            db.query(Image.id)
+            .filter(Image.id == image_id, Image.file_data.isnot(None))
+            .first()
         )
-    finally:
-        db.close()
+        if stored:
+            return Response(status_code=304, headers=headers)
+
+    # Just the two columns — no Image entity, and no second SELECT for
+    # the deferred blob
+    row = (
+        db.query(Image.file_data, Image.file_mimetype)
+        .filter(Image.id == image_id)
+        .first()
+    )
+    if not row or not row.file_data:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return Response(
+        content=row.file_data,
+        media_type=row.file_mimetype or "image/jpeg",
+        headers=headers,
+    )
 
 
 # ── Schedule Instagram post ───────────────────────────
 
 @router.get("/schedule", response_class=HTMLResponse)
-async def schedule_page(request: Request, _=Depends(require_login)):
-    db = SessionLocal()
-    try:
-        ig_images = (
-            db.query(Image)
-            .filter(Image.content_type == ContentType.INSTAGRAM.value, Image.is_active == True)
-            .order_by(Image.created_at.desc())
-            .all()
-        )
-        scheduled = (
-            db.query(ScheduledPost)
-            .order_by(ScheduledPost.scheduled_at.desc())
-            .limit(30)
-            .all()
-        )
-
-        has_ig_creds = bool(INSTAGRAM_USER_ID and INSTAGRAM_ACCESS_TOKEN)
-
-        return templates.TemplateResponse("schedule.html", {
-            "request": request,
-            "ig_images": ig_images,
-            "scheduled": scheduled,
-            "has_ig_creds": has_ig_creds,
-        })
-    finally:
-        db.close()
+async def schedule_page(request: Request, _=Depends(require_login), db: Session = Depends(get_db)):
+    ig_images = (
+        db.query(Image.id, Image.title)
+        .filter(Image.content_type == ContentType.INSTAGRAM.value, Image.is_active == True)
+        .order_by(Image.created_at.desc())
+        .all()
+    )
+    scheduled = (
+        db.query(ScheduledPost)
+        .options(joinedload(ScheduledPost.image))
+        .order_by(ScheduledPost.scheduled_at.desc())
+        .limit(30)
+        .all()
+    )
+
+    has_ig_creds = bool(INSTAGRAM_USER_ID and INSTAGRAM_ACCESS_TOKEN)
+
+    return templates.TemplateResponse("schedule.html", {
+        "request": request,
+        "ig_images": ig_images,
+        "scheduled": scheduled,
+        "has_ig_creds": has_ig_creds,
+    })
 
 
 @router.post("/schedule")
@@ -316,91 +446,109 @@ async def schedule_submit(
     scheduled_date: str = Form(...),
     scheduled_time: str = Form(...),
     _=Depends(require_login),
+    db: Session = Depends(get_db),
 ):
     # Validate image is Instagram-safe
-    db = SessionLocal()
-    try:
-        image = db.query(Image).get(image_id)
-        if not image or image.content_type != ContentType.INSTAGRAM.value:
-            raise HTTPException(status_code=400, detail="Image is not Instagram-safe")
-
-        # Auto-generate AI caption if left blank
-        if not caption.strip():
-            try:
-                caption = await generate_caption(image.title, image.description or "")
-            except Exception as e:
-                logger.warning(f"AI caption generation failed: {e}")
-                caption = ""
-
-        scheduled_at = datetime.datetime.fromisoformat(f"{scheduled_date}T{scheduled_time}")
-
-        post = ScheduledPost(
-            image_id=image_id,
-            caption=caption,
-            scheduled_at=scheduled_at,
-        )
-        db.add(post)
-        db.commit()
-        return RedirectResponse("/dashboard/schedule", status_code=303)
-    finally:
-        db.close()
+    image = db.query(Image).get(image_id)
+    if not image or image.content_type != ContentType.INSTAGRAM.value:
+        raise HTTPException(status_code=400, detail="Image is not Instagram-safe")
+
+    # Auto-generate AI caption if left blank
+    if not caption.strip():
+        try:
+            caption = await generate_caption(image.title, image.description or "")
+        except Exception as e:
+            logger.warning(f"AI caption generation failed: {e}")
+            caption = ""
+
+    scheduled_at = datetime.datetime.fromisoformat(f"{scheduled_date}T{scheduled_time}")
+
+    post = ScheduledPost(
+        image_id=image_id,
+        caption=caption,
+        scheduled_at=scheduled_at,
+    )
+    db.add(post)
+    db.commit()
+    invalidate_dashboard_counts()
+    return RedirectResponse("/dashboard/schedule", status_code=303)
 
 
 @router.post("/schedule/{post_id}/delete")
-async def schedule_delete(post_id: int, request: Request, _=Depends(require_login)):
-    db = SessionLocal()
-    try:
-        post = db.query(ScheduledPost).get(post_id)
-        if post and post.status == "pending":
-            db.delete(post)
-            db.commit()
-        return RedirectResponse("/dashboard/schedule", status_code=303)
-    finally:
-        db.close()
+async def schedule_delete(
+    post_id: int,
+    request: Request,
+    _=Depends(require_login),
+    db: Session = Depends(get_db),
+):
+    post = db.query(ScheduledPost).get(post_id)
+    if post and post.status == "pending":
+        db.delete(post)
+        db.commit()
+        invalidate_dashboard_counts()
+    return RedirectResponse("/dashboard/schedule", status_code=303)
 
 
 @router.post("/schedule/{post_id}/post-now")
-async def post_now(post_id: int, request: Request, _=Depends(require_login)):
+async def post_now(
+    post_id: int,
+    request: Request,
+    _=Depends(require_login),
+    db: Session = Depends(get_db),
+):
     """Immediately post a scheduled post."""
     from bot.services.instagram import post_to_instagram, InstagramSafetyError
 
     if not INSTAGRAM_USER_ID or not INSTAGRAM_ACCESS_TOKEN:
         raise HTTPException(status_code=400, detail="Instagram credentials not configured")
 
-    db = SessionLocal()
-    try:
-        post = db.query(ScheduledPost).get(post_id)
-        if not post or post.status != "pending":
-            raise HTTPException(status_code=404, detail="Post not found or already processed")
+    post = (
+        db.query(ScheduledPost)
+        .options(joinedload(ScheduledPost.image))
+        .filter(ScheduledPost.id == post_id)
+        .first()
+    )
+    if not post or post.status != "pending":
+        raise HTTPException(status_code=404, detail="Post not found or already processed")
 
-        image = db.query(Image).get(post.image_id)
-        if not image:
-            raise HTTPException(status_code=404, detail="Image not found")
+    image = post.image
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
 
-        try:
-            result = await post_to_instagram(image, INSTAGRAM_USER_ID, INSTAGRAM_ACCESS_TOKEN, post.caption or "")
-            if result.get("success"):
-                post.status = "posted"
-                post.ig_media_id = result.get("media_id")
-                post.posted_at = datetime.datetime.utcnow()
-            else:
-                post.status = "failed"
-                post.error_message = result.get("error", "Unknown error")
-        except InstagramSafetyError as e:
-            post.status = "failed"
-            post.error_message = str(e)
-        except Exception as e:
+    try:
+        result = await post_to_instagram(image, INSTAGRAM_USER_ID, INSTAGRAM_ACCESS_TOKEN, post.caption or "")
+        if result.get("success"):
+            post.status = "posted"
+            post.ig_media_id = result.get("media_id")
+            post.posted_at = datetime.datetime.utcnow()
+        else:
             post.status = "failed"
-            post.error_message = str(e)
+            post.error_message = result.get("error", "Unknown error")
+    except InstagramSafetyError as e:
+        post.status = "failed"
+        post.error_message = str(e)
+    except Exception as e:
+        post.status = "failed"
+        post.error_message = str(e)
 
-        db.commit()
-        return RedirectResponse("/dashboard/schedule", status_code=303)
-    finally:
-        db.close()
+    db.commit()
+    invalidate_dashboard_counts()
+    return RedirectResponse("/dashboard/schedule", status_code=303)
 
 
 # ── Scheduler job: auto-post due scheduled posts ─────
 
+# Instagram publishes in flight at once when a backlog of posts is due
+IG_PUBLISH_CONCURRENCY = 4
+
+
+def _save_post_outcome(post_id: int, **values):
+    """Persist one scheduled post's publish outcome in its own short session."""
+    with SessionLocal() as db:
+        db.query(ScheduledPost).filter(ScheduledPost.id == post_id).update(values)
+        db.commit()
+
+
 async def process_scheduled_posts():
     """Called by APScheduler — posts any due scheduled posts."""
     from bot.services.instagram import post_to_instagram, InstagramSafetyError
@@ -413,40 +561,54 @@ async def process_scheduled_posts():
         now = datetime.datetime.utcnow()
         due_posts = (
             db.query(ScheduledPost)
+            .options(joinedload(ScheduledPost.image))
             .filter(ScheduledPost.status == "pending", ScheduledPost.scheduled_at <= now)
             .all()
         )
 
-        for post in due_posts:
-            image = db.query(Image).get(post.image_id)
+        sem = asyncio.Semaphore(IG_PUBLISH_CONCURRENCY)
+
+        async def _publish(post):
+            # Each outcome is saved as soon as its publish returns, so a
+            # crash mid-batch can't leave a published post pending
+            image = post.image
             if not image:
-                post.status = "failed"
-                post.error_message = "Image not found"
-                db.commit()
-                continue
-
-            try:
-                result = await post_to_instagram(
-                    image, INSTAGRAM_USER_ID, INSTAGRAM_ACCESS_TOKEN, post.caption or ""
+                await asyncio.to_thread(
+                    _save_post_outcome, post.id, status="failed", error_message="Image not found"
                 )
-                if result.get("success"):
-                    post.status = "posted"
-                    post.ig_media_id = result.get("media_id")
-                    post.posted_at = datetime.datetime.utcnow()
-                    logger.info(f"Scheduled post #{post.id} published to Instagram")
-                else:
-                    post.status = "failed"
-                    post.error_message = result.get("error", "Unknown error")
-                    logger.error(f"Scheduled post #{post.id} failed: {post.error_message}")
-            except InstagramSafetyError as e:
-                post.status = "failed"
-                post.error_message = str(e)
-                logger.critical(f"SAFETY BLOCK on scheduled post #{post.id}: {e}")
-            except Exception as e:
-                post.status = "failed"
-                post.error_message = str(e)
-                logger.error(f"Scheduled post #{post.id} error: {e}")
-
-            db.commit()
+                return
+
+            async with sem:
+                try:
+                    result = await post_to_instagram(
+                        image, INSTAGRAM_USER_ID, INSTAGRAM_ACCESS_TOKEN, post.caption or ""
+                    )
+                    if result.get("success"):
+                        outcome = {
+                            "status": "posted",
+                            "ig_media_id": result.get("media_id"),
+                            "posted_at": datetime.datetime.utcnow(),
+                        }
+                        logger.info(f"Scheduled post #{post.id} published to Instagram")
+                    else:
+                        outcome = {"status": "failed", "error_message": result.get("error", "Unknown error")}
+                        logger.error(f"Scheduled post #{post.id} failed: {outcome['error_message']}")
+                except InstagramSafetyError as e:
+                    outcome = {"status": "failed", "error_message": str(e)}
+                    logger.critical(f"SAFETY BLOCK on scheduled post #{post.id}: {e}")
+                except Exception as e:
+                    outcome = {"status": "failed", "error_message": str(e)}
+                    logger.error(f"Scheduled post #{post.id} error: {e}")
+
+            await asyncio.to_thread(_save_post_outcome, post.id, **outcome)
+
+        # The loading session only reads; outcomes are written through
+        # short sessions of their own while other publishes are in flight
+        results = await asyncio.gather(*(_publish(post) for post in due_posts), return_exceptions=True)
+        for post_id, result in zip((post.id for post in due_posts), results):
+            if isinstance(result, Exception):
+                logger.error(f"Scheduled post #{post_id} outcome not saved: {result}")
+        if due_posts:
+            invalidate_dashboard_counts()
     finally:
         db.close()